@@ -108,3 +108,6 @@ TRAFFIC_SIGN_LABELS = (
     "warning--vehicles-and-others--g1",
     "warning--wild-animals--g4",
 )
+
+# Excluded from exports unless --no-default-exclude is given (west, south, east, north)
+DEFAULT_EXCLUDE_BBOX = (-75.239868, 44.938314, -70.526733, 47.238919)
@@ -1,13 +1,265 @@
 import os
 import argparse
-import psycopg2
-from psycopg2.extras import RealDictCursor
 import json
 from dotenv import load_dotenv
-from constants import TRAFFIC_SIGN_LABELS
+from constants import DEFAULT_EXCLUDE_BBOX, TRAFFIC_SIGN_LABELS
+from regions import Region, parse_region, region_sql, store_regions
 
 load_dotenv()
 
+# Detections are ranked per class, then aggregated per image in Postgres, so each image
+# row arrives once and already shaped like the export (ordered by image id, so the
+# export can be streamed). {regions} takes the region predicates from region_sql().
+EXPORT_QUERY = """
+    WITH RankedResults AS (
+        SELECT
+            d.image_id,
+            d.id,
+            d.value,
+            d.bbox,
+            c.username as creator,
+            ROW_NUMBER() OVER(PARTITION BY d.value ORDER BY i.id) AS rn
+        FROM
+            image i
+        JOIN
+            detection d ON i.id = d.image_id
+        JOIN
+            creator c ON i.creator_id = c.id
+        WHERE
+            d.value IN %(values)s
+            AND i.uploaded = FALSE
+            {regions}
+    ),
+    ImageDetections AS (
+        SELECT
+            image_id,
+            creator,
+            json_agg(
+                json_build_object('id', id, 'value', value, 'bbox', bbox) ORDER BY id
+            ) AS detections
+        FROM
+            RankedResults
+        WHERE
+            rn <= 100
+        GROUP BY
+            image_id, creator
+    )
+    SELECT
+        i.url,
+        i.width,
+        i.height,
+        i.id,
+        r.detections,
+        i.sequence_id,
+        r.creator,
+        i.camera_type,
+        i.lat,
+        i.lon,
+        i.city
+    FROM
+        ImageDetections r
+    JOIN
+        image i ON i.id = r.image_id
+    ORDER BY
+        i.id;
+"""
+
+
+# One keyset page of a single class: the next detections after (after_image, after_id)
+# in (image_id, id) order, aggregated per image like EXPORT_QUERY. Taking the first
+# `limit` detections this way matches the global query's ROW_NUMBER() <= limit per
+# class, without ranking every class in one backend.
+CLASS_PAGE_QUERY = """
+    WITH Page AS (
+        SELECT
+            d.image_id,
+            d.id,
+            d.value,
+            d.bbox,
+            c.username as creator
+        FROM
+            detection d
+        JOIN
+            image i ON i.id = d.image_id
+        JOIN
+            creator c ON i.creator_id = c.id
+        WHERE
+            d.value = %(value)s
+            AND i.uploaded = FALSE
+            {regions}
+            AND (
+                %(after_image)s IS NULL
+                OR (d.image_id, d.id) > (%(after_image)s, %(after_id)s)
+            )
+        ORDER BY
+            d.image_id, d.id
+        LIMIT %(limit)s
+    ),
+    ImageDetections AS (
+        SELECT
+            image_id,
+            creator,
+            json_agg(
+                json_build_object('id', id, 'value', value, 'bbox', bbox) ORDER BY id
+            ) AS detections,
+            max(id) AS last_detection_id
+        FROM
+            Page
+        GROUP BY
+            image_id, creator
+    )
+    SELECT
+        i.url,
+        i.width,
+        i.height,
+        i.id,
+        r.detections,
+        i.sequence_id,
+        r.creator,
+        i.camera_type,
+        i.lat,
+        i.lon,
+        i.city,
+        r.last_detection_id
+    FROM
+        ImageDetections r
+    JOIN
+        image i ON i.id = r.image_id
+    ORDER BY
+        i.id;
+"""
+
+
+def iter_images(rows):
+    """Yield (image_id, image) for export rows. Columns are already in export order."""
+    for row in rows:
+        yield row["id"], dict(row)
+
+
+def iter_class_images(cur, value: str, limit: int, page_size: int, regions=("", {})):
+    """
+    Yield (image_id, image) for the first `limit` detections of one class, fetched in
+    keyset pages of at most page_size detections. An image split across two pages is
+    merged before it is yielded.
+    """
+    query = CLASS_PAGE_QUERY.format(regions=regions[0])
+    pending = None
+    after_image = after_id = None
+    remaining = limit
+    while remaining > 0:
+        page_limit = min(page_size, remaining)
+        cur.execute(
+            query,
+            {
+                **regions[1],
+                "value": value,
+                "after_image": after_image,
+                "after_id": after_id,
+                "limit": page_limit,
+            },
+        )
+        fetched = 0
+        for row in cur.fetchall():
+            image = dict(row)
+            after_image, after_id = image["id"], image.pop("last_detection_id")
+            fetched += len(image["detections"])
+            if pending is not None and pending["id"] == image["id"]:
+                pending["detections"].extend(image["detections"])
+                continue
+            if pending is not None:
+                yield pending["id"], pending
+            pending = image
+        remaining -= fetched
+        if fetched < page_limit:
+            break
+    if pending is not None:
+        yield pending["id"], pending
+
+
+def export_class_shard(
+    pool, value: str, shard_path: str, limit: int, page_size: int, regions
+) -> int:
+    """Export one class to its own shard file on a pooled connection. Returns images written."""
+    from psycopg2.extras import RealDictCursor
+
+    conn = pool.getconn()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur, open(
+            shard_path, "w"
+        ) as f:
+            exported = write_json_object(
+                f, iter_class_images(cur, value, limit, page_size, regions)
+            )
+        # end the read transaction before the connection goes back to the pool
+        conn.rollback()
+    finally:
+        pool.putconn(conn)
+    return exported
+
+
+def write_json_object(f, items) -> int:
+    """
+    Write (key, value) pairs as one JSON object, formatted exactly like
+    json.dump(dict(items), f, indent=4), without holding the pairs in memory.
+    Returns the number of pairs written.
+    """
+    count = 0
+    for key, value in items:
+        f.write("{\n    " if count == 0 else ",\n    ")
+        # nested lines get one more level of indentation, as json.dump would
+        f.write(f"{json.dumps(str(key))}: ")
+        f.write(json.dumps(value, indent=4).replace("\n", "\n    "))
+        count += 1
+    f.write("\n}" if count else "{}")
+    return count
+
+
+def export_per_class(conn_params: dict, values, regions, args) -> None:
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from psycopg2.pool import ThreadedConnectionPool
+
+    shard_dir = args.shard_dir or f"{os.path.splitext(args.output)[0]}_shards"
+    os.makedirs(shard_dir, exist_ok=True)
+    pool = ThreadedConnectionPool(1, args.workers, **conn_params)
+    total, failed = 0, []
+    try:
+        conn = pool.getconn()
+        try:
+            store_regions(conn, args.include + args.exclude)
+        finally:
+            pool.putconn(conn)
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {
+                executor.submit(
+                    export_class_shard,
+                    pool,
+                    value,
+                    os.path.join(shard_dir, f"{value}.json"),
+                    args.per_class_limit,
+                    args.page_size,
+                    regions,
+                ): value
+                for value in values
+            }
+            for future in as_completed(futures):
+                value = futures[future]
+                try:
+                    exported = future.result()
+                except Exception as e:
+                    print(f"Failed to export {value}: {e}")
+                    failed.append(value)
+                    continue
+                total += exported
+                print(f"Exported {exported} images for {value}")
+    finally:
+        pool.closeall()
+
+    print(
+        f"Exported {total} images across {len(values) - len(failed)} classes to {shard_dir}"
+    )
+    if failed:
+        raise SystemExit(f"{len(failed)} classes failed: {', '.join(sorted(failed))}")
+
 
 def main():
 
@@ -21,7 +273,74 @@ def main():
     parser.add_argument(
         "--value", "-v", required=False, help="Detection value/class to filter"
     )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read images through a server-side cursor and write them as they arrive "
+        "(constant memory for large exports)",
+    )
+    mode.add_argument(
+        "--per-class",
+        action="store_true",
+        help="Export each class to its own shard file, in parallel over a connection pool",
+    )
+    parser.add_argument(
+        "--itersize",
+        type=int,
+        default=2000,
+        help="Images fetched per round trip with --stream",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Database connections (and classes exported at once) with --per-class",
+    )
+    parser.add_argument(
+        "--shard-dir",
+        help="Where --per-class writes <class>.json shards (default: <output>_shards)",
+    )
+    parser.add_argument(
+        "--per-class-limit",
+        type=int,
+        default=100,
+        help="Detections exported per class with --per-class",
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=1000,
+        help="Detections fetched per keyset page with --per-class",
+    )
+    parser.add_argument(
+        "--include",
+        type=parse_region,
+        action="append",
+        default=[],
+        metavar="REGION",
+        help="Only export images in this region: west,south,east,north or a GeoJSON "
+        "polygon file (repeatable; images in any include region are exported)",
+    )
+    parser.add_argument(
+        "--exclude",
+        type=parse_region,
+        action="append",
+        default=[],
+        metavar="REGION",
+        help="Skip images in this region, same forms as --include (repeatable)",
+    )
+    parser.add_argument(
+        "--no-default-exclude",
+        action="store_true",
+        help="Don't exclude DEFAULT_EXCLUDE_BBOX from constants.py",
+    )
     args = parser.parse_args()
+    if not args.no_default_exclude:
+        args.exclude.append(Region(bbox=DEFAULT_EXCLUDE_BBOX))
+
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
 
     # --- PostgreSQL connection from environment variables ---
     conn_params = {
@@ -30,67 +349,34 @@ def main():
         "host": os.getenv("PGHOST"),
         "port": os.getenv("PGPORT"),
     }
+    values = (args.value,) if args.value else TRAFFIC_SIGN_LABELS
+    regions = region_sql(args.include, args.exclude)
 
-    # --- Connect to PostgreSQL ---
-    with psycopg2.connect(**conn_params) as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Fetch rows
-            cur.execute(
-                """
-                    WITH RankedResults AS (
-                        SELECT
-                            i.*,
-                            d.*,
-                            c.username as creator,
-                            ROW_NUMBER() OVER(PARTITION BY d.value ORDER BY i.id) AS rn
-                        FROM
-                            image i
-                        JOIN
-                            detection d ON i.id = d.image_id
-                        JOIN 
-                            creator c ON i.creator_id = c.id
-                        WHERE
-                            d.value IN %s
-                            AND i.uploaded = FALSE
-                            AND NOT i.location && ST_MakeEnvelope(-75.239868, 44.938314, -70.526733, 47.238919, 4326)
-                    )
-                    SELECT
-                        * FROM
-                        RankedResults
-                    WHERE
-                        rn <= 100;
-                """,
-                (args.value if args.value else TRAFFIC_SIGN_LABELS,),
-            )
-            rows = cur.fetchall()
-
-    # --- Group rows by image_id ---
-    output = {}
-    for row in rows:
-        image_id = row["image_id"]
-        if image_id not in output:
-            output[image_id] = {
-                "url": row.get("url"),
-                "width": row.get("width"),
-                "height": row.get("height"),
-                "id": image_id,
-                "detections": [],
-                "sequence_id": row.get("sequence_id"),
-                "creator": row.get("creator"),
-                "camera_type": row.get("camera_type"),
-                "lat": row.get("lat"),
-                "lon": row.get("lon"),
-                "city": row.get("city"),
-            }
-        output[image_id]["detections"].append(
-            {"id": row.get("id"), "value": row.get("value"), "bbox": row.get("bbox")}
-        )
+    if args.per_class:
+        export_per_class(conn_params, values, regions, args)
+        return
 
-    # --- Write to JSON ---
-    with open(args.output, "w") as f:
-        json.dump(output, f, indent=4)
+    # --- Connect to PostgreSQL and write images ---
+    query = EXPORT_QUERY.format(regions=regions[0])
+    params = {**regions[1], "values": values}
+    with psycopg2.connect(**conn_params) as conn, open(args.output, "w") as f:
+        store_regions(conn, args.include + args.exclude)
+        if args.stream:
+            # a named cursor keeps the result set on the server; iterating it fetches
+            # itersize rows at a time
+            with conn.cursor(
+                name="db_job_export", cursor_factory=RealDictCursor
+            ) as cur:
+                cur.itersize = args.itersize
+                cur.execute(query, params)
+                exported = write_json_object(f, iter_images(cur))
+        else:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, params)
+                rows = cur.fetchall()
+            exported = write_json_object(f, iter_images(rows))
 
-    print(f"Exported {len(output)} images to {args.output}")
+    print(f"Exported {exported} images to {args.output}")
 
 
 if __name__ == "__main__":
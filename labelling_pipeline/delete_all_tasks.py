@@ -5,8 +5,6 @@ Also resets all uploaded flags in the database to false.
 
 import os
 import argparse
-import psycopg2
-from label_studio_sdk import Client
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,6 +12,8 @@ load_dotenv()
 
 def delete_all_tasks_from_projects():
     """Delete all tasks from all Label Studio projects."""
+    from label_studio_sdk import Client
+
     try:
         # Initialize Label Studio client
         ls = Client(
@@ -58,6 +58,8 @@ def delete_all_tasks_from_projects():
 
 def reset_uploaded_flags():
     """Reset all uploaded flags in the database to false."""
+    import psycopg2
+
     try:
         # Database connection parameters
         conn_params = {
@@ -1,93 +1,168 @@
+import itertools
+import argparse
 import json
 import os
-from label_studio_sdk import Client
+import time
 from dotenv import load_dotenv
-import psycopg2
 from label_to_class_mapping import LABEL_TO_CLASS
 
 load_dotenv()
 
-uploaded_images = set()
+MANIFEST_NAME = "manifest.json"
+# images whose boxes are converted in one batch
+CONVERT_CHUNK_SIZE = 1000
 
-def prepare_json_for_label_studio(input_json_path: str, output_json_path: str):
-    with open(input_json_path, "r", encoding="utf-8") as f:
-        images = json.load(f)
-    """
-    Convert an input JSON (single image object or list of such objects) into a Label Studio
-    tasks JSON file. The input format must match the example provided by the user where each
-    image object contains keys like: id, url, width, height, detections (list of objects with
-    bbox [x1,y1,x2,y2] and value label string).
 
-    The output will be a list of tasks where each task is a dict with a `data` entry for the
-    image url and an optional `annotations` entry containing pre-annotations. BBoxes are
-    converted from pixels to percentages (Label Studio expects x,y,width,height in percent).
+def task_key(image_id, det_class: str) -> str:
+    """Stable key of the task for one (image, class); the same on every run."""
+    return f"{image_id}:{det_class}"
+
+
+def existing_task_keys(project, page_size: int = 1000) -> set[str]:
+    """task_key of every task already in a Label Studio project."""
+    keys = set()
+    page = 1
+    while True:
+        data = project.get_paginated_tasks(
+            page=page, page_size=page_size, resolve_uri=False
+        )
+        tasks = data.get("tasks") or []
+        for task in tasks:
+            key = (task.get("meta") or {}).get("task_key")
+            if key:
+                keys.add(key)
+        if data.get("end_pagination") or len(tasks) < page_size:
+            return keys
+        page += 1
 
-    Assumptions:
-    - Each detection has a `bbox` of [x1,y1,x2,y2]. Detections without bbox are skipped.
-    - The labeling control names are assumed to be `label` (from_name) and `image` (to_name).
-      If your project uses different names, adjust the returned objects accordingly.
 
+def iter_images(input_path: str):
     """
+    Yield image objects one at a time from a db_job.py export: a JSON object keyed by
+    image id (parsed incrementally), or JSONL with one image object per line.
+    """
+    if input_path.endswith(".jsonl"):
+        with open(input_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    import ijson
+
+    with open(input_path, "rb") as f:
+        for _, image in ijson.kvitems(f, "", use_float=True):
+            yield image
 
-    # input may be a single dict or a list
 
-    tasks = {}
+def bboxes_to_percent(bboxes: list, widths: list, heights: list):
+    """
+    Convert pixel [x1, y1, x2, y2] boxes to Label Studio percent x, y, width, height for
+    a whole chunk at once. Uses the same float operations, in the same order, as the
+    per-box formula, so results are identical.
+    Returns an (n, 4) array and a mask of valid boxes: boxes that aren't four finite
+    numbers with x2 >= x1 and y2 >= y1 are flagged invalid.
+    """
+    import numpy as np
+
+    try:
+        boxes = np.asarray(bboxes, dtype=np.float64).reshape(len(bboxes), 4)
+    except (TypeError, ValueError):
+        # ragged or non-numeric boxes; build row by row, leaving bad rows as NaN
+        boxes = np.full((len(bboxes), 4), np.nan)
+        for i, bbox in enumerate(bboxes):
+            try:
+                boxes[i] = np.asarray(bbox, dtype=np.float64).reshape(4)
+            except (TypeError, ValueError):
+                pass
+    widths = np.asarray(widths, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    x1, y1, x2, y2 = boxes.T
+
+    with np.errstate(invalid="ignore"):
+        percent = np.stack(
+            [
+                (x1 / widths) * 100,
+                (y1 / heights) * 100,
+                ((x2 - x1) / widths) * 100,
+                ((y2 - y1) / heights) * 100,
+            ],
+            axis=1,
+        )
+        valid = np.isfinite(percent).all(axis=1) & (x2 >= x1) & (y2 >= y1)
+    return percent, valid
+
+
+def images_to_tasks(images: list[dict]) -> list:
+    """
+    Convert a chunk of image objects into Label Studio tasks grouped by class.
 
-    for image_id in list(images.keys()): # [:100]: <-- limit to first <number> images for testing
+    Each image object contains keys like: id, url, width, height, detections (list of
+    objects with bbox [x1,y1,x2,y2] and value label string). A task is a dict with a
+    `data` entry for the image url and `predictions` holding the pre-annotations. BBoxes
+    are converted from pixels to percentages (Label Studio expects x,y,width,height in
+    percent) for the whole chunk at once.
 
-        unknown_label_found = False
+    Assumptions:
+    - Each detection has a `bbox` of [x1,y1,x2,y2]. Detections without bbox, and
+      malformed boxes, are skipped.
+    - The labeling control names are assumed to be `label` (from_name) and `image` (to_name).
+      If your project uses different names, adjust the returned objects accordingly.
 
-        image_data = images.get(image_id)
-        image_url = image_data.get("url")
+    Returns, per image, {class: task} with one task per class present in the image, or
+    None if the image has a detection with an unknown label (the whole image is skipped).
+    """
+    # (image index, detection id, label) for each box to convert
+    owners = []
+    bboxes, widths, heights = [], [], []
+    skipped = set()
+    for image_index, image_data in enumerate(images):
+        image_id = image_data.get("id")
         width = image_data.get("width")
         height = image_data.get("height")
-        image_id = image_data.get("id")
-        sequence_id = image_data.get("sequence_id")
-        creator = image_data.get("creator")
-        camera_type = image_data.get("camera_type")
-        lat = image_data.get("lat")
-        lon = image_data.get("lon")
-        city = image_data.get("city")
-
-        results = []
-        predictions = image_data.get("detections") or []
-
-        detections_by_class = {}
-        for det in predictions:
+        for det_index, det in enumerate(image_data.get("detections") or []):
             bbox = det.get("bbox")
             label = LABEL_TO_CLASS.get(det.get("value"), "unknown")
 
             if label == "unknown":
-                print(f"Warning: unknown label '{det.get('value')}' for detection id {det.get('id')}. Skipping.")
-                unknown_label_found = True
+                print(
+                    f"Warning: unknown label '{det.get('value')}' for detection id {det.get('id')}. Skipping."
+                )
+                skipped.add(image_index)
                 break
-                
-            det_id = det.get("id") or f"{image_id}-{len(results)}"
+
+            det_id = det.get("id") or f"{image_id}-{det_index}"
 
             if not bbox or width in (None, 0) or height in (None, 0):
                 # skip detections we cannot convert
                 continue
 
-            try:
-                x1, y1, x2, y2 = bbox
-            except Exception:
-                # malformed bbox
+            owners.append((image_index, det_id, label))
+            bboxes.append(bbox)
+            widths.append(width)
+            heights.append(height)
+
+    detections_by_class = [{} for _ in images]
+    if bboxes:
+        percent, valid = bboxes_to_percent(bboxes, widths, heights)
+        malformed = 0
+        for (image_index, det_id, label), (x, y, w, h), ok in zip(
+            owners, percent.tolist(), valid.tolist()
+        ):
+            if image_index in skipped:
                 continue
-
-            # convert to percentages expected by Label Studio
-            x = (x1 / width) * 100
-            y = (y1 / height) * 100
-            w = ((x2 - x1) / width) * 100
-            h = ((y2 - y1) / height) * 100
-
+            if not ok:
+                malformed += 1
+                continue
+            image_data = images[image_index]
             result = {
                 "id": str(det_id),
                 "type": "rectanglelabels",
                 "from_name": "label",
                 "to_name": "image",
                 "image_rotation": 0,
-                "original_width": width,
-                "original_height": height,
+                "original_width": image_data.get("width"),
+                "original_height": image_data.get("height"),
                 "value": {
                     "x": x,
                     "y": y,
@@ -97,113 +172,356 @@ def prepare_json_for_label_studio(input_json_path: str, output_json_path: str):
                     "rectanglelabels": [label] if label else [],
                 },
             }
+            detections_by_class[image_index].setdefault(label, []).append(result)
+        if malformed:
+            print(f"Warning: skipped {malformed} malformed bboxes.")
+
+    all_tasks = []
+    for image_index, image_data in enumerate(images):
+        if image_index in skipped:
+            all_tasks.append(None)
+            continue
+        image_id = image_data.get("id")
+        # one task per (image, class), holding every box of that class
+        tasks = {}
+        for det_class, results in detections_by_class[image_index].items():
+            tasks[det_class] = {
+                "data": {"image": image_data.get("url")},
+                "predictions": [{"result": results}],
+                "meta": {
+                    "task_key": task_key(image_id, det_class),
+                    # the image is only marked uploaded once all of its tasks are in
+                    "image_tasks": len(detections_by_class[image_index]),
+                    "image_id": image_id,
+                    "image_width": image_data.get("width"),
+                    "image_height": image_data.get("height"),
+                    "sequence_id": image_data.get("sequence_id"),
+                    "creator": image_data.get("creator"),
+                    "camera_type": image_data.get("camera_type"),
+                    "lat": image_data.get("lat"),
+                    "lon": image_data.get("lon"),
+                    "city": image_data.get("city"),
+                },
+            }
+        all_tasks.append(tasks)
+    return all_tasks
 
-            if label not in detections_by_class:
-                detections_by_class[label] = []
 
-            detections_by_class[label].append(result)
+def iter_chunks(items, size: int):
+    """Yield lists of up to size items."""
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
 
 
-        if unknown_label_found:
-            continue
-        else:
-            uploaded_images.add(image_id)
-
-        for det_class in detections_by_class.keys():
-            if det_class not in tasks:
-                tasks[det_class] = []
-            for det in detections_by_class[det_class]:
-                tasks[det_class].append(
-                    {
-                        "data": {"image": image_url},
-                        "predictions": [{"result": detections_by_class[det_class]}],
-                        "meta": {
-                            "image_id": image_id,
-                            "image_width": width,
-                            "image_height": height,
-                            "sequence_id": sequence_id,
-                            "creator": creator,
-                            "camera_type": camera_type,
-                            "lat": lat,
-                            "lon": lon,
-                            "city": city,
-                        },
-                    }
-                )
+def prepare_json_for_label_studio(input_path: str, output_dir: str):
+    """
+    Stream images from input_path and append their tasks to `<output_dir>/<class>.jsonl`
+    (one task per line), so memory stays bounded however large the export is. Images are
+    converted CONVERT_CHUNK_SIZE at a time. The per-class task counts are written to
+    `<output_dir>/manifest.json`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    files = {}
+    counts = {}
+    converted = 0
+    without_tasks = []
+    try:
+        for images in iter_chunks(iter_images(input_path), CONVERT_CHUNK_SIZE):
+            for image_data, tasks in zip(images, images_to_tasks(images)):
+                if tasks is None:
+                    continue
+                converted += 1
+                if not tasks:
+                    without_tasks.append(image_data.get("id"))
+
+                for det_class, task in tasks.items():
+                    if det_class not in files:
+                        files[det_class] = open(
+                            os.path.join(output_dir, f"{det_class}.jsonl"),
+                            "w",
+                            encoding="utf-8",
+                        )
+                        counts[det_class] = 0
+                    files[det_class].write(json.dumps(task, ensure_ascii=False) + "\n")
+                    counts[det_class] += 1
+    finally:
+        for f in files.values():
+            f.close()
+
+    # the manifest lists this run's class files; older files in output_dir are ignored
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "classes": counts,
+                "images": converted,
+                "images_without_tasks": without_tasks,
+            },
+            f,
+            indent=2,
+        )
+
+    print(
+        f"Wrote {sum(counts.values())} tasks for {converted} images in {len(counts)} "
+        f"classes to {output_dir}"
+    )
 
 
-    # write tasks to output
-    with open(output_json_path, "w", encoding="utf-8") as out:
-        json.dump(tasks, out, ensure_ascii=False, indent=2)
+def read_manifest(output_dir: str) -> dict:
+    with open(os.path.join(output_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        return json.load(f)
 
-    print(f"Wrote {len(tasks)} tasks to {output_json_path}")
 
+def iter_class_tasks(output_dir: str, class_name: str):
+    """Yield the tasks of one class file, one at a time."""
+    with open(
+        os.path.join(output_dir, f"{class_name}.jsonl"), "r", encoding="utf-8"
+    ) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def import_chunk(project, tasks: list[dict], retries: int, backoff: float) -> int:
+    """
+    Import one chunk of tasks, retrying with exponential backoff. A failed request may
+    still have been applied (a read timeout after the server accepted it), so before
+    each retry the project's task keys are re-read and only the tasks that aren't there
+    yet are resubmitted. Returns len(tasks).
+    """
+    remaining = tasks
+    for attempt in range(retries + 1):
+        try:
+            if attempt:
+                existing = existing_task_keys(project)
+                remaining = [
+                    task
+                    for task in remaining
+                    if task["meta"]["task_key"] not in existing
+                ]
+            if remaining:
+                project.import_tasks(remaining)
+            return len(tasks)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt
+            print(
+                f"Import of {len(tasks)} tasks into project {project.id} failed ({e}); "
+                f"retrying in {delay:.0f}s"
+            )
+            time.sleep(delay)
 
-if __name__ == "__main__":
-    import argparse
 
+class ImageTaskTracker:
+    """
+    Counts the tasks of each image that are in Label Studio, and reports images once all
+    of their class tasks are (tasks carry their image's task count in meta.image_tasks).
+    """
+
+    def __init__(self):
+        self.remaining = {}
+
+    def imported(self, tasks: list[dict]) -> list:
+        """Record tasks as imported; returns the image ids that just became complete."""
+        complete = []
+        for task in tasks:
+            meta = task["meta"]
+            image_id = meta["image_id"]
+            left = self.remaining.get(image_id, meta["image_tasks"]) - 1
+            if left:
+                self.remaining[image_id] = left
+            else:
+                self.remaining.pop(image_id, None)
+                complete.append(image_id)
+        return complete
+
+
+def mark_uploaded(conn, image_ids: list) -> None:
+    """Set uploaded = TRUE for image_ids in one transaction."""
+    if not image_ids:
+        return
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE image
+            SET uploaded = TRUE
+            WHERE id = ANY(%s);
+            """,
+            (image_ids,),
+        )
+
+
+def import_to_label_studio(
+    output_dir: str,
+    chunk_size: int = 500,
+    workers: int = 4,
+    retries: int = 3,
+    backoff: float = 2.0,
+    on_images_imported=None,
+) -> bool:
+    """
+    Import every class file listed in the manifest into the Label Studio project of the
+    same title. Each class is read and imported in chunks of chunk_size tasks, with up
+    to `workers` chunks in flight across all projects; a failed chunk is retried
+    `retries` times before it is reported. Tasks whose task_key is already in the
+    project are skipped and count as imported.
+
+    After each chunk, on_images_imported is called (from this thread) with the ids of
+    the images whose tasks are now all in Label Studio, so a caller can record progress
+    chunk by chunk; images without any task are reported with the first chunk. Returns
+    True if every chunk was imported.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    from label_studio_sdk import Client
+
+    classes = read_manifest(output_dir)["classes"]
+    ls = Client(
+        url=os.getenv("LABEL_STUDIO_URL"),
+        api_key=os.getenv("LABEL_STUDIO_API_KEY"),
+    )
+    projects = ls.get_projects()
+    project_dict = {p.title: p for p in projects}
+
+    tracker = ImageTaskTracker()
+    report = on_images_imported or (lambda image_ids: None)
+    # complete images not yet reported; flushed after each chunk
+    ready = list(read_manifest(output_dir).get("images_without_tasks", []))
+
+    def flush():
+        report(list(ready))
+        ready.clear()
+
+    imported, failed_chunks = 0, 0
+    pending = {}
+    start = time.monotonic()
+
+    def collect(done):
+        nonlocal imported, failed_chunks
+        for future in done:
+            class_name, chunk = pending.pop(future)
+            try:
+                imported += future.result()
+            except Exception as e:
+                failed_chunks += 1
+                print(f"Failed to import {len(chunk)} tasks for '{class_name}': {e}")
+                continue
+            ready.extend(tracker.imported(chunk))
+            flush()
+
+    def new_tasks(class_name, existing):
+        for task in iter_class_tasks(output_dir, class_name):
+            if task["meta"]["task_key"] in existing:
+                ready.extend(tracker.imported([task]))
+            else:
+                yield task
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for class_name in classes:
+            project = project_dict.get(class_name)
+            if not project:
+                print(
+                    f"No Label Studio project found with title '{class_name}'. Skipping import for this class."
+                )
+                continue
+
+            # tasks imported by an earlier run are skipped, so re-runs are idempotent
+            existing = existing_task_keys(project)
+            for chunk in iter_chunks(new_tasks(class_name, existing), chunk_size):
+                # bound the chunks held in memory to what the pool can work on
+                while len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = executor.submit(import_chunk, project, chunk, retries, backoff)
+                pending[future] = (class_name, chunk)
+            print(
+                f"Queued tasks for '{class_name}' (project {project.id}, "
+                f"{len(existing)} already there)"
+            )
+        collect(wait(pending).done)
+    flush()
+
+    elapsed = time.monotonic() - start
+    print(
+        f"Imported {imported} tasks from {output_dir} in {elapsed:.1f}s "
+        f"({imported / max(elapsed, 1e-9):.1f} tasks/sec)"
+    )
+    if failed_chunks:
+        print(f"{failed_chunks} chunks failed to import.")
+    return failed_chunks == 0
+
+
+def main():
     parser = argparse.ArgumentParser(
-        description="Convert image JSON(s) to Label Studio tasks.json"
+        description="Convert a db_job.py export to per-class Label Studio task files"
+    )
+    parser.add_argument(
+        "input",
+        help="Path to the db_job.py export (JSON object keyed by image id, or .jsonl)",
+    )
+    parser.add_argument(
+        "output", help="Directory to write <class>.jsonl Label Studio task files to"
     )
-    parser.add_argument("input", help="Path to input JSON file (single object or list)")
-    parser.add_argument("output", help="Path to write Label Studio tasks JSON")
     parser.add_argument(
         "--import",
         dest="do_import",
         action="store_true",
         help="If set, import the detections into Label Studio using LABEL_STUDIO_API_KEY",
     )
+    parser.add_argument(
+        "--chunk-size", type=int, default=500, help="Tasks per import request"
+    )
+    parser.add_argument(
+        "--import-workers",
+        type=int,
+        default=4,
+        help="Import requests in flight at once, across all projects",
+    )
+    parser.add_argument(
+        "--import-retries",
+        type=int,
+        default=3,
+        help="Retries per chunk (exponential backoff from 2s) before giving up on it",
+    )
 
     args = parser.parse_args()
     prepare_json_for_label_studio(args.input, args.output)
 
     if args.do_import:
-        try:
-            with open(args.output, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            # reuse project variable defined at module top
-            ls = Client(
-                url=os.getenv("LABEL_STUDIO_URL"),
-                api_key=os.getenv("LABEL_STUDIO_API_KEY"),
-            )
-            projects = ls.get_projects()
-            project_dict = {p.title: p for p in projects}
-
-            for class_name in data.keys():
-                project = project_dict.get(class_name)
-                if not project:
-                    print(f"No Label Studio project found with title '{class_name}'. Skipping import for this class.")
-                    continue
-
-                project.import_tasks(data[class_name])
-                print(
-                    f"Imported tasks from {args.output} into Label Studio project {project.id}"
-                )
-
-            conn = psycopg2.connect(
-                user=os.getenv("PGUSER"),
-                password=os.getenv("PGPASSWORD"),
-                host=os.getenv("PGHOST"),
-                port=os.getenv("PGPORT"),
-            )
-
-            cur = conn.cursor()
+        # only needed for --import
+        import psycopg2
+
+        conn = psycopg2.connect(
+            user=os.getenv("PGUSER"),
+            password=os.getenv("PGPASSWORD"),
+            host=os.getenv("PGHOST"),
+            port=os.getenv("PGPORT"),
+        )
+        marked = 0
+
+        def on_images_imported(image_ids):
+            # committed per imported chunk, so a failed run keeps what it finished
+            nonlocal marked
+            mark_uploaded(conn, image_ids)
+            marked += len(image_ids)
 
-            cur.execute(
-                """
-                UPDATE image
-                SET uploaded = TRUE
-                WHERE id = ANY(%s);
-                """,
-                (list(uploaded_images),)
+        try:
+            complete = import_to_label_studio(
+                args.output,
+                chunk_size=args.chunk_size,
+                workers=args.import_workers,
+                retries=args.import_retries,
+                on_images_imported=on_images_imported,
             )
-
-            conn.commit()
-            cur.close()
+            if not complete:
+                print("Some tasks failed to import; re-run to import the rest.")
+        except Exception as e:
+            print("Failed to import tasks into Label Studio:", e)
+        finally:
             conn.close()
 
-            print(f"Uploaded detections from {len(uploaded_images)} images into Label Studio.")
-            print(f"Marked {len(uploaded_images)} images as uploaded in the database.")
+        print(f"Marked {marked} images as uploaded in the database.")
 
-        except Exception as e:
-            print("Failed to import tasks into Label Studio:", e)
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()
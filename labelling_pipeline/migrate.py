@@ -0,0 +1,168 @@
+"""
+Versioned schema migrations for the labelling database (image/detection/creator).
+
+Each `migrations/NNN_name.sql` file is applied once, in order, in its own transaction,
+and recorded in `schema_migrations`.
+
+Usage:
+    python migrate.py up
+    python migrate.py status
+    python migrate.py explain    # EXPLAIN ANALYZE the export query, check the indexes
+"""
+
+import os
+import argparse
+import json
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# indexes from the migrations that the export plan is expected to use
+EXPORT_INDEXES = (
+    "image_not_uploaded_idx",
+    "image_location_gist_idx",
+    "detection_value_image_id_idx",
+)
+
+
+def _connect():
+    import psycopg2
+
+    return psycopg2.connect(
+        user=os.getenv("PGUSER"),
+        password=os.getenv("PGPASSWORD"),
+        host=os.getenv("PGHOST"),
+        port=os.getenv("PGPORT"),
+    )
+
+
+def list_migrations() -> list[tuple[str, str]]:
+    """Return sorted (version, path) for every migration file."""
+    return [
+        (name[: -len(".sql")], os.path.join(MIGRATIONS_DIR, name))
+        for name in sorted(os.listdir(MIGRATIONS_DIR))
+        if name.endswith(".sql")
+    ]
+
+
+def applied_versions(conn) -> set[str]:
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version TEXT PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """)
+        cur.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return versions
+
+
+def migrate_up() -> int:
+    """Apply pending migrations. Returns the number applied."""
+    applied = 0
+    conn = _connect()
+    try:
+        done = applied_versions(conn)
+        for version, path in list_migrations():
+            if version in done:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                sql = f.read()
+            # `with conn` commits the migration and its record together, or rolls both back
+            with conn, conn.cursor() as cur:
+                cur.execute(sql)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version) VALUES (%s)", (version,)
+                )
+            print(f"Applied {version}")
+            applied += 1
+    finally:
+        conn.close()
+    return applied
+
+
+def print_status() -> None:
+    conn = _connect()
+    try:
+        done = applied_versions(conn)
+    finally:
+        conn.close()
+    for version, _ in list_migrations():
+        print(f"{version:<40} {'applied' if version in done else 'pending'}")
+
+
+def _plan_index_names(plan: dict) -> set[str]:
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= _plan_index_names(child)
+    return names
+
+
+def explain_export() -> bool:
+    """
+    Run the export query under EXPLAIN (ANALYZE, FORMAT JSON) and report which of the
+    export indexes the plan uses. Returns False if it uses none of them.
+    """
+    from constants import DEFAULT_EXCLUDE_BBOX, TRAFFIC_SIGN_LABELS
+    from db_job import EXPORT_QUERY
+    from regions import Region, region_sql
+
+    # the default export: every class, outside the default exclude bbox
+    regions, params = region_sql([], [Region(bbox=DEFAULT_EXCLUDE_BBOX)])
+
+    conn = _connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "EXPLAIN (ANALYZE, FORMAT JSON) "
+                + EXPORT_QUERY.format(regions=regions),
+                {**params, "values": TRAFFIC_SIGN_LABELS},
+            )
+            result = cur.fetchone()[0]
+        conn.rollback()
+    finally:
+        conn.close()
+    if isinstance(result, str):
+        result = json.loads(result)
+
+    used = _plan_index_names(result[0]["Plan"])
+    print(f"Execution time: {result[0]['Execution Time']:.1f} ms")
+    for name in EXPORT_INDEXES:
+        print(f"  {name:<30} {'used' if name in used else 'not used'}")
+    others = sorted(used - set(EXPORT_INDEXES))
+    if others:
+        print(f"  other indexes: {', '.join(others)}")
+    return any(name in used for name in EXPORT_INDEXES)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Apply and check labelling database migrations"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("up", help="Apply pending migrations")
+    sub.add_parser("status", help="List migrations and whether they are applied")
+    sub.add_parser(
+        "explain",
+        help="EXPLAIN ANALYZE the export query and check it uses the export indexes",
+    )
+    args = parser.parse_args()
+
+    if args.command == "up":
+        applied = migrate_up()
+        print(f"{applied} migrations applied")
+    elif args.command == "status":
+        print_status()
+    elif args.command == "explain":
+        if not explain_export():
+            # on small tables the planner may rightly prefer sequential scans
+            sys.exit("The export plan uses none of the export indexes")
+
+
+if __name__ == "__main__":
+    main()
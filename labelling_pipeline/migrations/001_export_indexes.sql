@@ -0,0 +1,13 @@
+-- Indexes behind the db_job.py export filters.
+
+-- images that still need labelling; the export only ever reads these
+CREATE INDEX IF NOT EXISTS image_not_uploaded_idx ON image (id) WHERE uploaded = FALSE;
+
+-- spatial region predicates (location && envelope, ST_Intersects)
+CREATE INDEX IF NOT EXISTS image_location_gist_idx ON image USING GIST (location);
+
+-- d.value IN (...) joined to image, and ranked by image per class
+CREATE INDEX IF NOT EXISTS detection_value_image_idx ON detection (value, image_id);
+
+ANALYZE image;
+ANALYZE detection;
@@ -0,0 +1,7 @@
+-- db_job.py --per-class pages each class by (image_id, id); with id in the index the
+-- keyset predicate and ORDER BY are read straight off it. Replaces the (value, image_id)
+-- index from 001, which this one covers.
+
+CREATE INDEX IF NOT EXISTS detection_value_image_id_idx ON detection (value, image_id, id);
+DROP INDEX IF EXISTS detection_value_image_idx;
+ANALYZE detection;
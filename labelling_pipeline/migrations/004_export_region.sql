@@ -0,0 +1,10 @@
+-- Polygon regions for db_job.py --include/--exclude, keyed by a hash of their GeoJSON,
+-- so repeated exports reference the stored geometry instead of re-sending it.
+
+CREATE TABLE IF NOT EXISTS export_region (
+    hash TEXT PRIMARY KEY,
+    geom geometry(MultiPolygon, 4326) NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS export_region_geom_gist_idx ON export_region USING GIST (geom);
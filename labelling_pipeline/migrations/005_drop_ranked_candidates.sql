@@ -0,0 +1,5 @@
+-- Drop the ranked_candidates materialized view that an earlier optional migration
+-- created. Nothing read it: it ranked without the export's region filter, so the
+-- export queries couldn't use it.
+
+DROP MATERIALIZED VIEW IF EXISTS ranked_candidates;
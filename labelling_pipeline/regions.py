@@ -0,0 +1,117 @@
+"""
+Include/exclude regions for the export queries.
+
+A region is either a `west,south,east,north` bbox or the path to a GeoJSON file (a
+Polygon/MultiPolygon geometry, Feature or FeatureCollection). Bboxes become
+`i.location && ST_MakeEnvelope(...)`. Polygons are stored once in `export_region`
+(migration 004), keyed by a hash of the geometry, and later exports only send the key,
+so PostGIS doesn't re-parse and re-validate large polygons.
+
+Include predicates can be answered from the GiST index on image.location. Exclude
+predicates (`NOT ...`) can't: an index finds rows inside a region, not outside it, so
+they are checked per row on the images the rest of the query selects (the
+detection.value and not-uploaded indexes). A cheap bbox exclude therefore costs little,
+while a large, detailed exclude polygon is tested against every candidate image.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class Region:
+    bbox: Optional[tuple[float, float, float, float]] = None
+    geojson: Optional[str] = None
+    key: Optional[str] = None
+
+
+def _geometry(obj: dict) -> dict:
+    if obj.get("type") == "Feature":
+        return obj["geometry"]
+    if obj.get("type") == "FeatureCollection":
+        return {
+            "type": "GeometryCollection",
+            "geometries": [feature["geometry"] for feature in obj["features"]],
+        }
+    return obj
+
+
+def parse_region(spec: str) -> Region:
+    """Parse a `west,south,east,north` bbox or a GeoJSON file path."""
+    if os.path.isfile(spec):
+        with open(spec, "r", encoding="utf-8") as f:
+            geometry = _geometry(json.load(f))
+        geojson = json.dumps(geometry, sort_keys=True, separators=(",", ":"))
+        return Region(geojson=geojson, key=hashlib.sha256(geojson.encode()).hexdigest())
+
+    parts = spec.split(",")
+    if len(parts) != 4:
+        raise ValueError(f"not a GeoJSON file or west,south,east,north bbox: {spec}")
+    west, south, east, north = (float(p) for p in parts)
+    if west >= east or south >= north:
+        raise ValueError(f"empty bbox: {spec}")
+    return Region(bbox=(west, south, east, north))
+
+
+def store_regions(conn, regions: list[Region]) -> None:
+    """Insert the polygon regions that aren't in export_region yet."""
+    keys = [r.key for r in regions if r.geojson is not None]
+    if not keys:
+        return
+    with conn.cursor() as cur:
+        cur.execute("SELECT hash FROM export_region WHERE hash = ANY(%s)", (keys,))
+        stored = {row[0] for row in cur.fetchall()}
+        for region in regions:
+            if region.geojson is None or region.key in stored:
+                continue
+            # polygons only; ST_MakeValid so self-intersecting input still indexes
+            cur.execute(
+                """
+                INSERT INTO export_region (hash, geom)
+                VALUES (
+                    %s,
+                    ST_Multi(ST_CollectionExtract(
+                        ST_MakeValid(ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326)), 3
+                    ))
+                )
+                ON CONFLICT (hash) DO NOTHING
+                """,
+                (region.key, region.geojson),
+            )
+            stored.add(region.key)
+    conn.commit()
+
+
+def region_sql(
+    include: list[Region], exclude: list[Region]
+) -> tuple[str, dict[str, object]]:
+    """
+    Build the `AND ...` predicates on `i.location` for the export queries and their
+    named parameters. Images must fall in any include region and in no exclude region.
+    """
+    params = {}
+    counter = itertools.count()
+
+    def predicate(region: Region) -> str:
+        name = f"region_{next(counter)}"
+        if region.bbox is not None:
+            names = [f"{name}_{i}" for i in range(4)]
+            params.update(zip(names, region.bbox))
+            envelope = ", ".join(f"%({n})s" for n in names)
+            return f"i.location && ST_MakeEnvelope({envelope}, 4326)"
+        params[name] = region.key
+        return (
+            "ST_Intersects(i.location, "
+            f"(SELECT geom FROM export_region WHERE hash = %({name})s))"
+        )
+
+    clauses = []
+    if include:
+        clauses.append(f"AND ({' OR '.join(predicate(r) for r in include)})")
+    for region in exclude:
+        clauses.append(f"AND NOT ({predicate(region)})")
+    return "\n            ".join(clauses), params
@@ -0,0 +1,56 @@
+"""
+Memory benchmark: candidate images held as CandidateImage vs full MapillaryImage models.
+
+Usage:
+    python bench_candidates.py --count 200000
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from models import CandidateImage, MapillaryImage
+
+
+def _fake_meta(i: int) -> dict:
+    return {
+        "id": 100000000000000 + i,
+        "url": f"https://scontent.example.com/m1/v/t6/{i:016d}?stp=s2048x1536&ccb=10-5&oh=00_{i:032x}",
+        "camera_type": "perspective" if i % 5 else "fisheye",
+        "lat": 45.4 + i * 1e-6,
+        "lon": -73.9 + i * 1e-6,
+        "sequence": f"{i:022x}",
+        "width": 2048,
+        "height": 1536,
+    }
+
+
+def _measure(build, count: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    items = [build(**_fake_meta(i)) for i in range(count)]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--count", type=int, default=200_000, help="Number of candidates"
+    )
+    args = parser.parse_args()
+
+    model_peak = _measure(MapillaryImage, args.count)
+    compact_peak = _measure(CandidateImage, args.count)
+
+    mb = 1024 * 1024
+    print(f"{args.count} candidates")
+    print(f"  MapillaryImage     : {model_peak / mb:8.1f} MB")
+    print(f"  CandidateImage     : {compact_peak / mb:8.1f} MB")
+    print(f"  reduction          : {model_peak / compact_peak:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
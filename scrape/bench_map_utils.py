@@ -0,0 +1,156 @@
+"""
+Microbenchmarks: scalar map_utils tile/coordinate math vs the NumPy batch versions.
+Each case also checks that both produce identical results.
+
+Usage:
+    python bench_map_utils.py --count 1000000
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from map_utils import (
+    clamp_box,
+    clamp_boxes,
+    get_tiles_in_bbox,
+    lonlat_to_tile,
+    lonlat_to_tile_batch,
+    project_coords,
+    project_coords_batch,
+    tile_in_bbox,
+    tile_indices_in_bbox,
+    tiles_in_bbox_mask,
+)
+from models import BBox, Tile
+
+# roughly Quebec + Ontario; --tile-span picks a corner of it to enumerate
+COUNTRY_BBOX = BBox(west=-95.0, south=42.0, east=-57.0, north=56.0)
+
+
+def _get_tiles_in_bbox_scalar(bbox: BBox, strict=False) -> list[tuple[int, int]]:
+    """The previous nested-loop enumeration, for comparison."""
+    z = 14
+    x_min, y_max = lonlat_to_tile(bbox.west, bbox.north, z)
+    x_max, y_min = lonlat_to_tile(bbox.east, bbox.south, z)
+    n = 2**z
+    x_min = max(0, min(x_min, n - 1))
+    x_max = max(0, min(x_max, n - 1))
+    y_min = max(0, min(y_min, n - 1))
+    y_max = max(0, min(y_max, n - 1))
+    tiles = []
+    for x in range(min(x_min, x_max), max(x_min, x_max) + 1):
+        for y in range(min(y_min, y_max), max(y_min, y_max) + 1):
+            if strict and not tile_in_bbox(Tile(z=z, x=x, y=y), bbox):
+                continue
+            tiles.append((x, y))
+    return tiles
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _report(name: str, count: int, scalar_s: float, batch_s: float, equal: bool):
+    print(
+        f"{name:<22} n={count:>9,}  scalar {scalar_s * 1000:9.1f} ms  "
+        f"batch {batch_s * 1000:8.1f} ms  {scalar_s / batch_s:6.1f}x  "
+        f"{'identical' if equal else 'MISMATCH'}"
+    )
+    return equal
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--count", type=int, default=1_000_000, help="Points/boxes per case"
+    )
+    parser.add_argument(
+        "--tile-span",
+        type=float,
+        default=2.0,
+        help="Degrees of COUNTRY_BBOX (from its south-west corner) to enumerate tiles for",
+    )
+    args = parser.parse_args()
+    rng = random.Random(0)
+    n = args.count
+    ok = True
+
+    lons = [rng.uniform(-180, 180) for _ in range(n)]
+    lats = [rng.uniform(-85, 85) for _ in range(n)]
+    scalar, s_t = _timed(
+        lambda: [lonlat_to_tile(lo, la, 14) for lo, la in zip(lons, lats)]
+    )
+    (bx, by), b_t = _timed(lambda: lonlat_to_tile_batch(lons, lats, 14))
+    ok &= _report(
+        "lonlat_to_tile", n, s_t, b_t, scalar == list(zip(bx.tolist(), by.tolist()))
+    )
+
+    bbox = BBox(west=-80.0, south=43.0, east=-70.0, north=47.0)
+    xs = [rng.randrange(4000, 5500) for _ in range(n // 10)]
+    ys = [rng.randrange(5500, 6100) for _ in range(n // 10)]
+    tiles = [Tile(z=14, x=x, y=y) for x, y in zip(xs, ys)]
+    scalar, s_t = _timed(lambda: [tile_in_bbox(t, bbox) for t in tiles])
+    mask, b_t = _timed(lambda: tiles_in_bbox_mask(xs, ys, 14, bbox))
+    ok &= _report("tile_in_bbox", len(tiles), s_t, b_t, scalar == mask.tolist())
+
+    # the batch inputs are already arrays here; building one from a list of tuples
+    # costs about as much as the scalar loop itself
+    coords = [(rng.uniform(0, 4096), rng.uniform(0, 4096)) for _ in range(n)]
+    coords_arr = np.array(coords)
+    scalar, s_t = _timed(lambda: project_coords(coords, 2048, 1536))
+    proj, b_t = _timed(lambda: project_coords_batch(coords_arr, 2048, 1536))
+    ok &= _report(
+        "project_coords", n, s_t, b_t, scalar == [tuple(p) for p in proj.tolist()]
+    )
+
+    boxes = [
+        (
+            rng.uniform(-50, 2100),
+            rng.uniform(-50, 1600),
+            rng.uniform(-50, 2100),
+            rng.uniform(-50, 1600),
+        )
+        for _ in range(n)
+    ]
+    # include exact .5 values, where round() and np.rint must agree (half to even)
+    boxes[: n // 100] = [(10.5, 11.5, 2.5, 3.5)] * (n // 100)
+    boxes_arr = np.array(boxes)
+    scalar, s_t = _timed(lambda: [clamp_box(*b, 2048, 1536) for b in boxes])
+    clamped, b_t = _timed(lambda: clamp_boxes(boxes_arr, 2048, 1536))
+    ok &= _report(
+        "clamp_box", n, s_t, b_t, scalar == [tuple(b) for b in clamped.tolist()]
+    )
+
+    span = BBox(
+        west=COUNTRY_BBOX.west,
+        south=COUNTRY_BBOX.south,
+        east=COUNTRY_BBOX.west + args.tile_span,
+        north=COUNTRY_BBOX.south + args.tile_span,
+    )
+    scalar, s_t = _timed(lambda: _get_tiles_in_bbox_scalar(span, strict=True))
+    batch, b_t = _timed(lambda: get_tiles_in_bbox(span, strict=True))
+    ok &= _report(
+        "get_tiles_in_bbox", len(batch), s_t, b_t, scalar == [(t.x, t.y) for t in batch]
+    )
+
+    (ix, iy), i_t = _timed(lambda: tile_indices_in_bbox(span, strict=True))
+    ok &= _report(
+        "tile_indices_in_bbox",
+        len(ix),
+        s_t,
+        i_t,
+        scalar == list(zip(ix.tolist(), iy.tolist())),
+    )
+
+    if not ok:
+        raise SystemExit("batch results differ from the scalar functions")
+
+
+if __name__ == "__main__":
+    np.seterr(all="raise")
+    main()
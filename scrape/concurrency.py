@@ -0,0 +1,212 @@
+"""
+Adaptive concurrency for Mapillary API calls.
+
+`AdaptiveLimiter` caps the number of in-flight requests with an AIMD window: the limit
+grows additively (about +1 per window of fast, successful calls) and halves on 429/5xx
+or transport errors. A circuit breaker on top of it stops all calls for a while after
+a run of consecutive failures, then lets a single probe through before reopening.
+
+Every call site in mapillary_api goes through the shared limiter from `get_api_limiter()`.
+Image downloads are additionally bounded by a global in-flight `ByteBudget`.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+
+from config import MAP_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        target_latency: float,
+        failure_threshold: int,
+        open_seconds: float,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+
+        self._limit = float(max(min_limit, min(initial, max_limit)))
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._consecutive_failures = 0
+        self._last_decrease = 0.0
+        self._state = self.CLOSED
+        self._open_until = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def acquire(self) -> bool:
+        """
+        Block until a request slot is free and the circuit allows calls.
+        Returns True if this call is the half-open probe; pass it back to release().
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._state == self.OPEN:
+                    if now < self._open_until:
+                        self._cond.wait(self._open_until - now)
+                        continue
+                    self._state = self.HALF_OPEN
+                    logger.warning("circuit half-open, sending a probe request")
+
+                if self._state == self.HALF_OPEN:
+                    if self._probe_in_flight:
+                        self._cond.wait()
+                        continue
+                    self._probe_in_flight = True
+                    self._in_flight += 1
+                    return True
+
+                if self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    return False
+                self._cond.wait()
+
+    def release(self, latency: float, ok: bool, probe: bool = False) -> None:
+        """
+        Return a slot and feed the outcome back into the window.
+        ok=False means the API signalled overload (429/5xx) or the request errored out.
+        probe is acquire()'s return value: only the probe decides whether a half-open
+        circuit closes or trips again.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if probe:
+                self._probe_in_flight = False
+                if ok:
+                    self._state = self.CLOSED
+                    self._consecutive_failures = 0
+                    logger.warning("circuit closed, API recovered")
+                else:
+                    self._trip()
+                self._cond.notify_all()
+                return
+            if self._state != self.CLOSED:
+                # a request from before the circuit opened; it only gives its slot back
+                self._cond.notify_all()
+                return
+
+            if ok:
+                self._consecutive_failures = 0
+                if latency <= self.target_latency:
+                    self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            else:
+                self._consecutive_failures += 1
+                now = time.monotonic()
+                # at most one multiplicative decrease per latency window
+                if now - self._last_decrease > self.target_latency:
+                    self._limit = max(self.min_limit, self._limit / 2)
+                    self._last_decrease = now
+                    logger.debug("API overloaded, concurrency limit -> %d", self.limit)
+                if self._consecutive_failures >= self.failure_threshold:
+                    self._trip()
+            self._cond.notify_all()
+
+    def _trip(self) -> None:
+        self._state = self.OPEN
+        self._open_until = time.monotonic() + self.open_seconds
+        self._limit = float(self.min_limit)
+        logger.warning(
+            "circuit open after %d consecutive failures, pausing API calls for %.0fs",
+            self._consecutive_failures,
+            self.open_seconds,
+        )
+
+
+class ByteBudget:
+    """
+    Global budget of bytes held by in-flight image downloads.
+
+    Downloads reserve their size (Content-Length when known) before reading the body
+    and release it once the image is saved, so the scrape stays in a fixed memory
+    envelope no matter how many large originals happen to be in flight. A single
+    download bigger than the whole budget may run, but only on its own.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    def acquire(self, n: int) -> int:
+        """Block until n bytes fit in the budget. Returns n for the matching release()."""
+        with self._cond:
+            while self._in_use > 0 and self._in_use + n > self.limit_bytes:
+                self._cond.wait()
+            self._in_use += n
+        return n
+
+    def adjust(self, delta: int) -> None:
+        """Correct a reservation once the real size is known (never blocks)."""
+        with self._cond:
+            self._in_use += delta
+            if delta < 0:
+                self._cond.notify_all()
+
+    def release(self, n: int) -> None:
+        if not n:
+            return
+        with self._cond:
+            self._in_use -= n
+            self._cond.notify_all()
+
+
+_limiter: Optional[AdaptiveLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_api_limiter() -> AdaptiveLimiter:
+    """Shared limiter, built from MAP_CONFIG on first use."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = AdaptiveLimiter(
+                    initial=MAP_CONFIG.MAX_CONCURRENT_WORKERS,
+                    min_limit=MAP_CONFIG.MIN_ADAPTIVE_WORKERS,
+                    max_limit=MAP_CONFIG.MAX_ADAPTIVE_WORKERS,
+                    target_latency=MAP_CONFIG.TARGET_LATENCY,
+                    failure_threshold=MAP_CONFIG.BREAKER_FAILURE_THRESHOLD,
+                    open_seconds=MAP_CONFIG.BREAKER_OPEN_SECONDS,
+                )
+    return _limiter
+
+
+_budget: Optional[ByteBudget] = None
+
+
+def get_byte_budget() -> ByteBudget:
+    """Shared download byte budget, sized from MAP_CONFIG on first use."""
+    global _budget
+    if _budget is None:
+        with _limiter_lock:
+            if _budget is None:
+                _budget = ByteBudget(MAP_CONFIG.MAX_IN_FLIGHT_BYTES)
+    return _budget
@@ -1,31 +1,81 @@
 import os
 import sys
+import threading
 
-import requests
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+class _LazySession:
+    """
+    Class attribute that builds the shared requests session on first access,
+    so importing the config (e.g. for `--help`) doesn't pay for `requests`
+    or require a token.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+
+    def __get__(self, obj, owner):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create(owner.TOKEN)
+        return self._session
+
+    @staticmethod
+    def _create(token):
+        if not token:
+            sys.exit("ERROR: set MAPILLARY_TOKEN (starts with 'MLY|...')")
+        import requests
+
+        session = requests.Session()
+        session.params.update({"access_token": token})
+        return session
+
+
 # ----------------------------
 # Config
 # ----------------------------
 class MAP_CONFIG:
     TOKEN = os.getenv("MAPILLARY_TOKEN")
-    if not TOKEN:
-        sys.exit("ERROR: set MAPILLARY_TOKEN (starts with 'MLY|...')")
 
     # API politeness / retries
     SLEEP_BETWEEN_PAGES = 0.05
     RETRY_BASE_SLEEP = 1.0
     RETRY_TRIES = 6
-    MAX_CONCURRENT_WORKERS = 8
+    MAX_CONCURRENT_WORKERS = 8  # starting concurrency; adapts between the bounds below
+    MIN_ADAPTIVE_WORKERS = 1
+    MAX_ADAPTIVE_WORKERS = 32
+    TARGET_LATENCY = (
+        5.0  # seconds; only grow concurrency while calls are faster than this
+    )
+    BREAKER_FAILURE_THRESHOLD = (
+        10  # consecutive overload errors before pausing all calls
+    )
+    BREAKER_OPEN_SECONDS = 30.0
+
+    # Memory envelope for image downloads held between download and save
+    MAX_IN_FLIGHT_BYTES = 512 * 1024 * 1024
+    DEFAULT_IMAGE_BYTES = 4 * 1024 * 1024  # reserved when there's no Content-Length
+    # processes for MVT/image decoding; 0 runs it inline on the calling thread
+    MAX_CPU_WORKERS = os.cpu_count() or 1
 
     # Image selection
     MAX_IMAGES_PER_ID = 50
     ASPECT_PANO_RATIO = 2.0  # width/height >= => treat as panoramic
     REJECT_CT = {"spherical", "equirectangular"}
 
-    # Shared session with token
-    session = requests.Session()
-    session.params.update({"access_token": TOKEN})
+    # Perceptual de-duplication of downloaded images: None (off), "skip" or "flag"
+    DEDUP_MODE = None
+    DEDUP_MAX_DISTANCE = 4  # max Hamming distance between 64-bit dHashes
+
+    # Build decoded tile features without pydantic validation once a cheap shape check
+    # passes (--trust-tile-features). Off by default: with pydantic-core, validating
+    # is about as fast as the trusted constructors plus the check.
+    TRUST_TILE_FEATURES = False
+
+    # Shared session with token, created on first use
+    session = _LazySession()
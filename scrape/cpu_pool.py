@@ -0,0 +1,125 @@
+"""
+Process pool for the CPU-bound parts of a scrape.
+
+Network calls stay on the scraper's thread pools; MVT decoding, detection box projection
+and image decode/re-encode are shipped here so they aren't serialized by the GIL.
+Threads call `run_cpu(fn, *args)`, which blocks only the calling thread. The pool size is
+`MAP_CONFIG.MAX_CPU_WORKERS`; 0 runs everything inline (the default with `--profile`,
+which only sees the scraper process).
+"""
+
+import atexit
+import io
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from config import MAP_CONFIG
+from dedup import dhash
+from map_utils import geometry_to_pixel_bboxes
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_atexit_registered = False
+
+
+def get_cpu_pool() -> Optional[ProcessPoolExecutor]:
+    """Shared pool, created on first use. None when CPU work should run inline."""
+    global _pool, _atexit_registered
+    if MAP_CONFIG.MAX_CPU_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # the pool is first used from inside the scraper's thread pools; forking
+                # a process with live threads and SQLite handles can deadlock the child
+                method = (
+                    "forkserver"
+                    if "forkserver" in multiprocessing.get_all_start_methods()
+                    else "spawn"
+                )
+                _pool = ProcessPoolExecutor(
+                    max_workers=MAP_CONFIG.MAX_CPU_WORKERS,
+                    mp_context=multiprocessing.get_context(method),
+                )
+                if not _atexit_registered:
+                    atexit.register(shutdown_cpu_pool)
+                    _atexit_registered = True
+    return _pool
+
+
+def shutdown_cpu_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def run_cpu(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Run fn(*args) on the CPU pool and wait for the result.
+    If the pool is broken (a worker died, e.g. OOM-killed or crashed in a decoder), it is
+    replaced and fn is resubmitted once, so one dead worker doesn't fail every later call.
+    """
+    global _pool
+    pool = get_cpu_pool()
+    if pool is None:
+        return fn(*args)
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        with _pool_lock:
+            # every thread waiting on the dead pool gets here; only the first replaces it
+            if _pool is pool:
+                logger.warning("CPU pool worker died; starting a new pool")
+                pool.shutdown(wait=False)
+                _pool = None
+    pool = get_cpu_pool()
+    if pool is None:
+        return fn(*args)
+    return pool.submit(fn, *args).result()
+
+
+# ----------------------------
+# Pool tasks (module-level so they pickle)
+# ----------------------------
+def decode_tile(data: bytes, x: int, y: int, z: int) -> Optional[dict]:
+    """MVT tile bytes => GeoJSON dict, or None for Mapillary's empty tile."""
+    import mapbox_vector_tile
+    from vt2geojson.tools import vt_bytes_to_geojson
+
+    mvt_repr = mapbox_vector_tile.decode(data)
+    if "water" in mvt_repr:
+        # this is the representation of the tile when it is empty. wtf mapillary??
+        return None
+    return vt_bytes_to_geojson(data, x, y, z)
+
+
+def process_image_bytes(
+    raw: bytes, with_phash: bool = False
+) -> tuple[bytes, int, int, Optional[int]]:
+    """
+    Decode a downloaded image and re-encode it as RGB JPEG.
+    Returns (jpeg, width, height, perceptual hash or None).
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(raw)) as im:
+        rgb = im.convert("RGB")
+    out = io.BytesIO()
+    rgb.save(out, format="JPEG")
+    phash = dhash(rgb) if with_phash else None
+    return out.getvalue(), rgb.width, rgb.height, phash
+
+
+def parse_detection_bboxes(
+    geometries: list[str], img_w: int, img_h: int
+) -> list[list[tuple[int, int, int, int]]]:
+    """Pixel bboxes for each detection geometry of one image."""
+    return [geometry_to_pixel_bboxes(g, img_w, img_h) for g in geometries]
@@ -0,0 +1,139 @@
+"""
+Persistent dead-letter store for failed fetches.
+
+Tiles whose vector tile request failed, features whose image lookup failed, and images
+whose detections/download failed are recorded with the failure reason and an attempt
+count instead of being dropped. `scrape_bounding_box.py --replay-failures` retries only
+those items (see `mapillary_api.replay_failures`) and removes the ones that succeed.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+TILE = "tile"
+FEATURE = "feature"
+IMAGE = "image"
+
+
+@dataclass
+class DeadLetter:
+    kind: str
+    key: str
+    payload: dict
+    reason: str
+    attempts: int
+    last_failed_at: float
+
+
+class DeadLetterStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # shared by the scraper's worker threads, serialized by self._lock
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS dead_letters (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    reason TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    last_failed_at REAL NOT NULL,
+                    PRIMARY KEY (kind, key)
+                )
+                """)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def record(self, kind: str, key, payload: dict, reason: str) -> None:
+        """Record a failure, or bump the attempt count of an already recorded one."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO dead_letters (kind, key, payload, reason, attempts, last_failed_at)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT (kind, key) DO UPDATE SET
+                    payload = excluded.payload,
+                    reason = excluded.reason,
+                    attempts = attempts + 1,
+                    last_failed_at = excluded.last_failed_at
+                """,
+                (kind, str(key), json.dumps(payload), reason, time.time()),
+            )
+
+    def resolve(self, kind: str, key) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM dead_letters WHERE kind = ? AND key = ?", (kind, str(key))
+            )
+
+    def attempts(self, kind: str, key) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts FROM dead_letters WHERE kind = ? AND key = ?",
+                (kind, str(key)),
+            ).fetchone()
+        return row[0] if row else 0
+
+    def resolve_if_retried_ok(self, entry: DeadLetter) -> bool:
+        """Drop an entry replayed without a new failure being recorded. Returns True if dropped."""
+        if self.attempts(entry.kind, entry.key) == entry.attempts:
+            self.resolve(entry.kind, entry.key)
+            return True
+        return False
+
+    def pending(self, kind: str = None) -> list[DeadLetter]:
+        query = "SELECT kind, key, payload, reason, attempts, last_failed_at FROM dead_letters"
+        params = ()
+        if kind:
+            query += " WHERE kind = ?"
+            params = (kind,)
+        with self._lock:
+            rows = self._conn.execute(
+                query + " ORDER BY last_failed_at", params
+            ).fetchall()
+        return [
+            DeadLetter(kind, key, json.loads(payload), reason, attempts, failed_at)
+            for kind, key, payload, reason, attempts, failed_at in rows
+        ]
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, COUNT(*) FROM dead_letters GROUP BY kind"
+            ).fetchall()
+        return dict(rows)
+
+
+_store: Optional[DeadLetterStore] = None
+
+
+def configure(path: Optional[str]) -> Optional[DeadLetterStore]:
+    """Set (or with None, clear) the store that `record_failure` writes to."""
+    global _store
+    _store = DeadLetterStore(path) if path else None
+    return _store
+
+
+def get_store() -> Optional[DeadLetterStore]:
+    return _store
+
+
+def record_failure(kind: str, key, payload: dict, reason: str) -> None:
+    """Record a failed fetch in the configured store; no-op when none is configured."""
+    if _store is None:
+        return
+    try:
+        _store.record(kind, key, payload, reason)
+    except sqlite3.Error as e:
+        logger.warning("could not record %s %s in dead-letter store: %s", kind, key, e)
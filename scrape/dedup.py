@@ -0,0 +1,167 @@
+"""
+Perceptual-hash de-duplication of downloaded images.
+
+Mapillary serves visually identical frames under different image ids (re-uploads,
+stationary cameras). Each downloaded image gets a 64-bit difference hash (dHash); hashes
+are kept in a BK-tree so "anything within N bits?" lookups stay fast at millions of
+images, and persisted to `<output_dir>/.phash_index` so later runs dedup against
+everything already saved. Images skipped as near-duplicates are listed in
+`<output_dir>/.phash_skipped`, so later skip-mode runs don't download them again.
+"""
+
+import logging
+import os
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = ".phash_index"
+SKIPPED_FILENAME = ".phash_skipped"
+
+
+def dhash(image, hash_size: int = 8) -> int:
+    """64-bit difference hash of a PIL image: compares horizontally adjacent pixels."""
+    from PIL import Image
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance.
+    Each node is [hash, item, {distance: child}]; a radius query only descends into
+    children whose edge distance is within `radius` of the query's distance to the node.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, item: int) -> None:
+        self._size += 1
+        if self._root is None:
+            self._root = [value, item, {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(value, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, item, {}]
+                return
+            node = child
+
+    def find(self, value: int, radius: int) -> list[tuple[int, int]]:
+        """All (distance, item) within `radius` bits of value, closest first."""
+        if self._root is None:
+            return []
+        out = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                out.append((d, node[1]))
+            for edge, child in node[2].items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        out.sort()
+        return out
+
+
+class PerceptualDedup:
+    """
+    Thread-safe near-duplicate index backed by an append-only file of "<hash hex> <image id>" lines.
+
+    mode:
+      - "skip": near-duplicates are not saved
+      - "flag": near-duplicates are saved with `duplicate_of` set in their JSON
+    """
+
+    def __init__(self, output_dir: str, max_distance: int = 4, mode: str = "skip"):
+        if mode not in ("skip", "flag"):
+            raise ValueError(f"dedup mode must be 'skip' or 'flag', got {mode}")
+        self.max_distance = max_distance
+        self.mode = mode
+        self.path = os.path.join(output_dir, INDEX_FILENAME)
+        self.skipped_path = os.path.join(output_dir, SKIPPED_FILENAME)
+        self._tree = BKTree()
+        self.skipped: set[int] = set()
+        self._pending: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 2:
+                        continue
+                    self._tree.add(int(parts[0], 16), int(parts[1]))
+            logger.info(
+                "loaded %d perceptual hashes from %s", len(self._tree), self.path
+            )
+        if os.path.exists(self.skipped_path):
+            # "<image id> <id of the image it duplicates>" lines
+            with open(self.skipped_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if parts:
+                        self.skipped.add(int(parts[0]))
+
+    def check(self, image_id: int, phash: int) -> Optional[int]:
+        """
+        Return the id of an indexed or in-flight near-duplicate, or None.
+        An image that isn't a duplicate is held as pending, so concurrent look-alikes see
+        it, but is only indexed once `commit()` is called after it was saved.
+        An image never matches itself (e.g. when re-scraped after its files were removed).
+        """
+        with self._lock:
+            for _, item in self._tree.find(phash, self.max_distance):
+                if item != image_id:
+                    return item
+            for item, value in self._pending.items():
+                if item != image_id and hamming(phash, value) <= self.max_distance:
+                    return item
+            self._pending[image_id] = phash
+            return None
+
+    def commit(self, image_id: int) -> None:
+        """Index and persist a pending image once it has been saved."""
+        with self._lock:
+            phash = self._pending.pop(image_id, None)
+            if phash is None:
+                return
+            self._tree.add(phash, image_id)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(f"{phash:016x} {image_id}\n")
+
+    def record_skip(self, image_id: int, duplicate_of: int) -> None:
+        """Persist that an image was skipped as a near-duplicate of another."""
+        with self._lock:
+            if image_id in self.skipped:
+                return
+            self.skipped.add(image_id)
+            with open(self.skipped_path, "a", encoding="utf-8") as f:
+                f.write(f"{image_id} {duplicate_of}\n")
+
+    def discard(self, image_id: int) -> None:
+        """Forget a pending image that wasn't saved; no-op once committed."""
+        with self._lock:
+            self._pending.pop(image_id, None)
@@ -0,0 +1,159 @@
+"""
+Dry-run cost estimate for a bbox/tile scrape.
+
+Samples a few of the tiles `get_tiles_in_bbox` would scrape, resolves a sample of their
+features to candidate images, fetches detections and the `Content-Length` (HEAD) for a
+sample of those images, and downloads a couple of them to measure bandwidth. The counts
+and per-call latencies are then extrapolated to the whole scrape. Sampled calls go
+through the API response cache when `--cache` is set, so an estimate followed by the
+real scrape doesn't pay for them twice.
+"""
+
+import logging
+import random
+import re
+import time
+from dataclasses import dataclass
+from statistics import mean
+
+from config import MAP_CONFIG
+from models import Tile
+from mapillary_api import (
+    TRAFFIC_SIGN_REGEX,
+    _api_get,
+    _api_head,
+    get_candidate_images,
+    get_detections_by_image,
+    get_valid_ids_in_tile,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScrapeEstimate:
+    tiles: int
+    sampled_tiles: int
+    features: float
+    sampled_features: int
+    candidates: float
+    sampled_images: int
+    images_saved: float
+    bytes: float
+    seconds: float
+
+
+def estimate_scrape(
+    tiles: list[Tile],
+    sample_tiles: int = 10,
+    sample_features: int = 50,
+    sample_images: int = 30,
+    sample_downloads: int = 2,
+    json_only: bool = False,
+    seed: int = 0,
+) -> ScrapeEstimate:
+    """Extrapolate tile/feature/image/byte counts and run time from a sample of the scrape."""
+    rng = random.Random(seed)
+
+    # tiles => features
+    tile_sample = rng.sample(tiles, min(sample_tiles, len(tiles)))
+    features = []
+    feature_counts = []
+    tile_seconds = []
+    for tile in tile_sample:
+        start = time.monotonic()
+        feats = get_valid_ids_in_tile(tile)
+        tile_seconds.append(time.monotonic() - start + MAP_CONFIG.SLEEP_BETWEEN_PAGES)
+        feature_counts.append(len(feats))
+        features.extend(feats)
+    features_per_tile = mean(feature_counts) if feature_counts else 0.0
+
+    # features => candidate images
+    feature_sample = rng.sample(features, min(sample_features, len(features)))
+    start = time.monotonic()
+    candidates = get_candidate_images(feature_sample) if feature_sample else []
+    feature_seconds = (time.monotonic() - start) / max(1, len(feature_sample))
+    candidates_per_feature = len(candidates) / max(1, len(feature_sample))
+
+    # candidates => images with traffic sign detections, and their size
+    image_sample = rng.sample(candidates, min(sample_images, len(candidates)))
+    with_detections = 0
+    sizes = []
+    detection_seconds = []
+    for cand in image_sample:
+        start = time.monotonic()
+        try:
+            dets = get_detections_by_image(cand.to_image())
+        except Exception as e:
+            logger.warning("sampling detections of %s failed: %s", cand.id, e)
+            continue
+        detection_seconds.append(time.monotonic() - start)
+        if not any(re.match(TRAFFIC_SIGN_REGEX, d.value) for d in dets):
+            continue
+        with_detections += 1
+        if json_only:
+            continue
+        try:
+            r = _api_head(cand.url, timeout=30, allow_redirects=True)
+            length = r.headers.get("Content-Length", "")
+        except Exception as e:
+            logger.warning("HEAD of %s failed: %s", cand.id, e)
+            continue
+        if length.isdigit():
+            sizes.append(int(length))
+    saved_fraction = with_detections / max(1, len(detection_seconds))
+    mean_bytes = mean(sizes) if sizes else MAP_CONFIG.DEFAULT_IMAGE_BYTES
+
+    # bandwidth from a couple of full downloads
+    download_seconds = 0.0
+    if not json_only:
+        downloaded, elapsed = 0, 0.0
+        for cand in image_sample[:sample_downloads]:
+            start = time.monotonic()
+            try:
+                r = _api_get(cand.url, timeout=120)
+                r.raise_for_status()
+            except Exception as e:
+                logger.warning("sample download of %s failed: %s", cand.id, e)
+                continue
+            elapsed += time.monotonic() - start
+            downloaded += len(r.content)
+        if downloaded:
+            download_seconds = mean_bytes * elapsed / downloaded
+
+    n_features = features_per_tile * len(tiles)
+    n_candidates = candidates_per_feature * n_features
+    n_saved = saved_fraction * n_candidates
+    # calls run MAX_CONCURRENT_WORKERS at a time (the limiter's starting window)
+    call_seconds = (
+        len(tiles) * (mean(tile_seconds) if tile_seconds else 0.0)
+        + n_features * feature_seconds
+        + n_candidates * (mean(detection_seconds) if detection_seconds else 0.0)
+        + n_saved * download_seconds
+    )
+    return ScrapeEstimate(
+        tiles=len(tiles),
+        sampled_tiles=len(tile_sample),
+        features=n_features,
+        sampled_features=len(feature_sample),
+        candidates=n_candidates,
+        sampled_images=len(image_sample),
+        images_saved=n_saved,
+        bytes=0.0 if json_only else n_saved * mean_bytes,
+        seconds=call_seconds / max(1, MAP_CONFIG.MAX_CONCURRENT_WORKERS),
+    )
+
+
+def format_estimate(est: ScrapeEstimate) -> str:
+    hours, rest = divmod(int(est.seconds), 3600)
+    return "\n".join(
+        [
+            f"tiles            : {est.tiles} ({est.sampled_tiles} sampled)",
+            f"features         : ~{est.features:,.0f} ({est.sampled_features} sampled)",
+            f"candidate images : ~{est.candidates:,.0f} ({est.sampled_images} sampled)",
+            f"images saved     : ~{est.images_saved:,.0f}",
+            f"download volume  : ~{est.bytes / 1024**3:,.2f} GiB",
+            f"ETA              : ~{hours}h{rest // 60:02d}m "
+            f"at {MAP_CONFIG.MAX_CONCURRENT_WORKERS} concurrent requests",
+        ]
+    )
@@ -0,0 +1,533 @@
+"""
+Batch runner for multi-region scrapes.
+
+A JSON config lists regions (bbox), optional class filters and output directories, see
+`jobs.example.json`. `enqueue` splits every region into z14 tiles and stores one work
+unit per tile in a persistent SQLite queue; `work` starts worker processes that claim
+units from it until it is empty, sharing one API response cache; `status` reports
+progress per job. Re-running `enqueue` only adds tiles that aren't queued yet. A worker
+sends a heartbeat for the unit it is running; units whose heartbeat stopped (the worker
+was killed) are handed out again. The API concurrency limits in MAP_CONFIG are shared
+out between the workers, so `--workers` doesn't multiply the load on the API.
+
+    python job_runner.py enqueue jobs.json
+    python job_runner.py work --workers 4
+    python job_runner.py status
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# seconds between heartbeats of a running unit; --stale-minutes should cover several
+HEARTBEAT_SECONDS = 30
+
+LOG_LEVEL_MAP = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+}
+
+
+@dataclass
+class WorkUnit:
+    id: int
+    job: str
+    z: int
+    x: int
+    y: int
+    classes: Optional[list[str]]
+    output_dir: str
+    json_only: bool
+    attempts: int
+
+
+class WorkQueue:
+    """SQLite-backed queue of per-tile work units, safe to share between processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # autocommit mode; claims open their own BEGIN IMMEDIATE transaction
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS units (
+                id INTEGER PRIMARY KEY,
+                job TEXT NOT NULL,
+                z INTEGER NOT NULL,
+                x INTEGER NOT NULL,
+                y INTEGER NOT NULL,
+                classes TEXT,
+                output_dir TEXT NOT NULL,
+                json_only INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                updated_at REAL,
+                heartbeat_at REAL,
+                features INTEGER,
+                saved INTEGER,
+                error TEXT,
+                UNIQUE (job, z, x, y)
+            );
+            CREATE INDEX IF NOT EXISTS units_status ON units (status, id);
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(units)")}
+        if "heartbeat_at" not in columns:
+            # queues created before heartbeats
+            self._conn.execute("ALTER TABLE units ADD COLUMN heartbeat_at REAL")
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def set_setting(self, key: str, value) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO settings VALUES (?, ?)", (key, json.dumps(value))
+        )
+
+    def get_setting(self, key: str, default=None):
+        row = self._conn.execute(
+            "SELECT value FROM settings WHERE key = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def enqueue(self, job: dict, tiles: Iterable[tuple[int, int, int]]) -> int:
+        """Queue one unit per (z, x, y) tile of a job. Returns how many units were new."""
+        classes = json.dumps(job["classes"]) if job.get("classes") else None
+        rows = [
+            (
+                job["name"],
+                z,
+                x,
+                y,
+                classes,
+                job["output_dir"],
+                bool(job.get("json_only")),
+            )
+            for z, x, y in tiles
+        ]
+        before = self._conn.total_changes
+        self._conn.execute("BEGIN")
+        self._conn.executemany(
+            """
+            INSERT OR IGNORE INTO units (job, z, x, y, classes, output_dir, json_only)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        self._conn.execute("COMMIT")
+        return self._conn.total_changes - before
+
+    def claim(self, worker: str) -> Optional[WorkUnit]:
+        """Atomically mark the oldest pending unit as running for `worker`."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                """
+                SELECT id, job, z, x, y, classes, output_dir, json_only, attempts
+                FROM units WHERE status = ? ORDER BY id LIMIT 1
+                """,
+                (PENDING,),
+            ).fetchone()
+            if row is None:
+                self._conn.execute("COMMIT")
+                return None
+            now = time.time()
+            self._conn.execute(
+                """
+                UPDATE units SET status = ?, worker = ?, attempts = attempts + 1,
+                    updated_at = ?, heartbeat_at = ?
+                WHERE id = ?
+                """,
+                (RUNNING, worker, now, now, row[0]),
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        unit_id, job, z, x, y, classes, output_dir, json_only, attempts = row
+        return WorkUnit(
+            unit_id,
+            job,
+            z,
+            x,
+            y,
+            json.loads(classes) if classes else None,
+            output_dir,
+            bool(json_only),
+            attempts + 1,
+        )
+
+    def complete(self, unit_id: int, features: int, saved: int) -> None:
+        self._conn.execute(
+            """
+            UPDATE units SET status = ?, features = ?, saved = ?, error = NULL,
+                updated_at = ?
+            WHERE id = ?
+            """,
+            (DONE, features, saved, time.time(), unit_id),
+        )
+
+    def fail(self, unit_id: int, error: str, retry: bool) -> None:
+        """Record a failed unit; with retry it goes back to pending for another worker."""
+        self._conn.execute(
+            "UPDATE units SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (PENDING if retry else FAILED, error, time.time(), unit_id),
+        )
+
+    def heartbeat(self, unit_id: int, worker: str) -> None:
+        """Mark a unit as still being worked on by `worker`."""
+        self._conn.execute(
+            "UPDATE units SET heartbeat_at = ? WHERE id = ? AND status = ? AND worker = ?",
+            (time.time(), unit_id, RUNNING, worker),
+        )
+
+    def reset_stale(self, older_than_seconds: float) -> int:
+        """
+        Put running units whose worker stopped sending heartbeats (it died) back to
+        pending. Units of live workers are left alone however long they take.
+        """
+        cur = self._conn.execute(
+            """
+            UPDATE units SET status = ?
+            WHERE status = ? AND COALESCE(heartbeat_at, updated_at) < ?
+            """,
+            (PENDING, RUNNING, time.time() - older_than_seconds),
+        )
+        return cur.rowcount
+
+    def retry_failed(self) -> int:
+        cur = self._conn.execute(
+            "UPDATE units SET status = ?, attempts = 0 WHERE status = ?",
+            (PENDING, FAILED),
+        )
+        return cur.rowcount
+
+    def status(self) -> list[tuple]:
+        """Per job: (job, pending, running, done, failed, features, saved)."""
+        return self._conn.execute("""
+            SELECT job,
+                SUM(status = 'pending'), SUM(status = 'running'),
+                SUM(status = 'done'), SUM(status = 'failed'),
+                COALESCE(SUM(features), 0), COALESCE(SUM(saved), 0)
+            FROM units GROUP BY job ORDER BY MIN(id)
+            """).fetchall()
+
+
+def load_config(path: str) -> dict:
+    """Read and check a jobs config: {"cache": ..., "jobs": [{name, bbox, output_dir, ...}]}."""
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    names = set()
+    for job in config.get("jobs", []):
+        for key in ("name", "bbox", "output_dir"):
+            if key not in job:
+                raise ValueError(f"job {job} is missing '{key}'")
+        if job["name"] in names:
+            raise ValueError(f"duplicate job name {job['name']}")
+        names.add(job["name"])
+        if len(job["bbox"]) != 4:
+            raise ValueError(
+                f"job {job['name']}: bbox must be [west, south, east, north]"
+            )
+    return config
+
+
+def enqueue(queue: WorkQueue, config: dict) -> None:
+    from map_utils import tile_indices_in_bbox
+    from models import BBox
+
+    for key in ("cache", "cache_ttl_hours", "cache_max_entries"):
+        if key in config:
+            queue.set_setting(key, config[key])
+    for job in config["jobs"]:
+        west, south, east, north = job["bbox"]
+        bbox = BBox(west=west, south=south, east=east, north=north)
+        # country-sized regions have millions of tiles; skip building Tile models
+        xs, ys = tile_indices_in_bbox(bbox, strict=job.get("strict", True))
+        tiles = [(14, x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+        added = queue.enqueue(job, tiles)
+        print(f"{job['name']}: {len(tiles)} tiles, {added} newly queued")
+
+
+def _process_unit(unit: WorkUnit) -> tuple[int, int]:
+    """Scrape one tile into its job's output directory. Returns (features, images saved)."""
+    import dead_letter
+    from mapillary_api import get_valid_ids_in_tile, save_images_with_detections_by_id
+    from models import Tile
+
+    os.makedirs(unit.output_dir, exist_ok=True)
+    store = dead_letter.get_store()
+    if store is None or store.path != os.path.join(
+        unit.output_dir, ".dead_letters.sqlite"
+    ):
+        if store is not None:
+            store.close()
+        store = dead_letter.configure(
+            os.path.join(unit.output_dir, ".dead_letters.sqlite")
+        )
+
+    tile = Tile(z=unit.z, x=unit.x, y=unit.y)
+    tile_failures = store.attempts(dead_letter.TILE, str(tile))
+    feats = get_valid_ids_in_tile(tile, unit.classes)
+    if store.attempts(dead_letter.TILE, str(tile)) > tile_failures:
+        raise RuntimeError(f"tile {tile} request failed")
+    store.resolve(dead_letter.TILE, str(tile))
+
+    saved = 0
+    if feats:
+        saved = save_images_with_detections_by_id(
+            feats, unit.output_dir, unit.json_only
+        )
+    return len(feats), saved
+
+
+class _Heartbeat:
+    """Context manager that sends heartbeats for one unit from a background thread."""
+
+    def __init__(self, queue_path: str, unit_id: int, worker: str):
+        self.queue_path = queue_path
+        self.unit_id = unit_id
+        self.worker = worker
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        # sqlite3 connections can't be shared between threads
+        queue = WorkQueue(self.queue_path)
+        try:
+            while not self._stop.wait(HEARTBEAT_SECONDS):
+                try:
+                    queue.heartbeat(self.unit_id, self.worker)
+                except sqlite3.Error as e:
+                    logger.warning("heartbeat for unit %s failed: %s", self.unit_id, e)
+        finally:
+            queue.close()
+
+    def __enter__(self) -> "_Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def _worker_main(
+    queue_path: str,
+    worker: str,
+    log_level: str,
+    cpu_workers: int,
+    max_attempts: int,
+    workers: int,
+) -> None:
+    # one progress bar per worker process would interleave on the terminal
+    os.environ.setdefault("TQDM_DISABLE", "1")
+    logging.basicConfig(
+        level=LOG_LEVEL_MAP[log_level],
+        format=f"%(asctime)s - {worker} - %(name)s - %(levelname)s - %(message)s",
+    )
+    from config import MAP_CONFIG
+    import response_cache
+
+    MAP_CONFIG.MAX_CPU_WORKERS = cpu_workers
+    # each process has its own limiter; split the API budget so the workers together
+    # stay within the limits of a single scrape
+    MAP_CONFIG.MAX_CONCURRENT_WORKERS = max(
+        1, MAP_CONFIG.MAX_CONCURRENT_WORKERS // workers
+    )
+    MAP_CONFIG.MAX_ADAPTIVE_WORKERS = max(
+        MAP_CONFIG.MIN_ADAPTIVE_WORKERS, MAP_CONFIG.MAX_ADAPTIVE_WORKERS // workers
+    )
+    queue = WorkQueue(queue_path)
+    cache_path = queue.get_setting("cache")
+    if cache_path:
+        response_cache.configure(
+            cache_path,
+            queue.get_setting("cache_ttl_hours", 24 * 7) * 3600,
+            queue.get_setting("cache_max_entries", 1_000_000),
+        )
+
+    try:
+        while True:
+            unit = queue.claim(worker)
+            if unit is None:
+                break
+            try:
+                with _Heartbeat(queue_path, unit.id, worker):
+                    features, saved = _process_unit(unit)
+            except Exception as e:
+                retry = unit.attempts < max_attempts
+                logger.warning(
+                    "unit %s %d/%d/%d failed (attempt %d%s): %s",
+                    unit.job,
+                    unit.z,
+                    unit.x,
+                    unit.y,
+                    unit.attempts,
+                    ", will retry" if retry else "",
+                    e,
+                )
+                queue.fail(unit.id, repr(e), retry)
+            else:
+                queue.complete(unit.id, features, saved)
+    finally:
+        queue.close()
+
+
+def work(
+    queue_path: str,
+    workers: int,
+    log_level: str,
+    cpu_workers: int,
+    max_attempts: int,
+    stale_minutes: float,
+    report_every: float,
+) -> None:
+    queue = WorkQueue(queue_path)
+    reset = queue.reset_stale(stale_minutes * 60)
+    if reset:
+        print(f"Re-queued {reset} units left running by a previous worker")
+
+    host = socket.gethostname()
+    procs = [
+        multiprocessing.Process(
+            target=_worker_main,
+            args=(
+                queue_path,
+                f"{host}:{os.getpid()}:{i}",
+                log_level,
+                cpu_workers,
+                max_attempts,
+                workers,
+            ),
+            name=f"scrape-worker-{i}",
+        )
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    try:
+        while any(p.is_alive() for p in procs):
+            for p in procs:
+                p.join(timeout=report_every / len(procs))
+            # units of a worker that was killed since the run started
+            reset = queue.reset_stale(stale_minutes * 60)
+            if reset:
+                print(f"Re-queued {reset} units whose worker stopped responding")
+            print_status(queue)
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        queue.close()
+
+
+def print_status(queue: WorkQueue) -> None:
+    rows = queue.status()
+    header = ("job", "pending", "running", "done", "failed", "features", "saved")
+    width = max([len(header[0])] + [len(r[0]) for r in rows])
+    print(f"{header[0]:<{width}} " + " ".join(f"{h:>8}" for h in header[1:]))
+    for job, *counts in rows:
+        print(f"{job:<{width}} " + " ".join(f"{c:>8}" for c in counts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--queue", type=str, default="scrape_queue.sqlite", help="Work queue database"
+    )
+    parser.add_argument("--log-level", type=str, help="Log level", default="WARNING")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = sub.add_parser(
+        "enqueue", help="Queue the tiles of every job in a config"
+    )
+    enqueue_parser.add_argument(
+        "config", type=str, help="Jobs config (see jobs.example.json)"
+    )
+
+    work_parser = sub.add_parser(
+        "work", help="Run worker processes until the queue is empty"
+    )
+    work_parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+    work_parser.add_argument(
+        "--cpu-workers",
+        type=int,
+        default=0,
+        help="Decoding processes per worker (default: 0, decode inline in the worker)",
+    )
+    work_parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="Attempts before a unit is marked failed",
+    )
+    work_parser.add_argument(
+        "--stale-minutes",
+        type=float,
+        default=5,
+        help="Re-queue running units whose worker sent no heartbeat for this long",
+    )
+    work_parser.add_argument(
+        "--retry-failed", action="store_true", help="Re-queue units marked failed"
+    )
+    work_parser.add_argument(
+        "--report-every", type=float, default=30, help="Seconds between status reports"
+    )
+
+    sub.add_parser("status", help="Show progress per job")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=LOG_LEVEL_MAP[args.log_level],
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    queue = WorkQueue(args.queue)
+    try:
+        if args.command == "enqueue":
+            enqueue(queue, load_config(args.config))
+        elif args.command == "status":
+            print_status(queue)
+            return
+        elif args.retry_failed:
+            print(f"Re-queued {queue.retry_failed()} failed units")
+    finally:
+        queue.close()
+
+    if args.command == "work":
+        work(
+            args.queue,
+            args.workers,
+            args.log_level,
+            args.cpu_workers,
+            args.max_attempts,
+            args.stale_minutes,
+            args.report_every,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,6 @@ import math
 import logging
 from typing import Any, Optional, Sequence
 
-import mapbox_vector_tile
-
 from models import (
     Tile,
     BBox,
@@ -15,6 +13,8 @@ logger = logging.getLogger(__name__)
 
 def decode_geometry(geom_bytes: str) -> Optional[dict[str, Any]]:
     """Base64 MVT => dict, or None."""
+    import mapbox_vector_tile
+
     return mapbox_vector_tile.decode(base64.b64decode(geom_bytes))
 
 
@@ -45,6 +45,47 @@ def clamp_box(
     return xi1, yi1, xi2, yi2
 
 
+def mvt_bbox_to_pixel_bbox(
+    bbox: Sequence[tuple[float, float]], img_w: int, img_h: int, extent: int = 4096
+) -> tuple[int, int, int, int]:
+    """
+    Parses the Map Vectory Tile (MVT) format bbox (originating at bottom-left (0,0))
+    to pixel coordinates (top-left (0,0)) and returns a tuple of representing the bounding box.
+    """
+    proj = project_coords(bbox, img_w, img_h, extent=extent)
+    xs = [p[0] for p in proj]
+    ys = [p[1] for p in proj]
+    xmin, xmax = min(xs), max(xs)
+    ymin, ymax = min(ys), max(ys)
+    return clamp_box(xmin, ymin, xmax, ymax, img_w, img_h)
+
+
+def geometry_to_pixel_bboxes(
+    geometry: str, img_w: int, img_h: int
+) -> list[tuple[int, int, int, int]]:
+    """
+    Parse the detections geometry MVT to a list of pixel coordinate bounding boxes.
+    Each box is a tuple of (xmin, ymin, xmax, ymax).
+    """
+    decoded = decode_geometry(geometry)
+    if not decoded:
+        return []
+    boxes = []
+    for _, layer in decoded.items():
+        extent = layer.get("extent", 4096)
+        for feature in layer.get("features") or []:
+            geom = feature.get("geometry") or {}
+            if geom.get("type") != "Polygon":
+                continue
+            box = (geom.get("coordinates") or [[]])[0]
+            if not box:
+                continue
+
+            boxes.append(mvt_bbox_to_pixel_bbox(box, img_w, img_h, extent))
+
+    return boxes
+
+
 def lonlat_to_tile(lon: float, lat: float, z: int) -> tuple[int, int]:
     """
     Convert longitude and latitude to tile x, y at zoom z.
@@ -92,22 +133,103 @@ def get_tiles_in_bbox(bbox: BBox, strict=False) -> list[Tile]:
     """
     From a bounding box, get all vector tiles of zoom level 14 that overlap in it.
     If strict is True, only return tiles that fully contain the bbox.
+    Tiles are ordered by x, then y.
     """
-    z = 14
-    x_min, y_max = lonlat_to_tile(bbox.west, bbox.north, z)
-    x_max, y_min = lonlat_to_tile(bbox.east, bbox.south, z)
+    xs, ys = tile_indices_in_bbox(bbox, strict)
+    return [Tile(z=14, x=x, y=y) for x, y in zip(xs.tolist(), ys.tolist())]
+
+
+def tile_indices_in_bbox(bbox: BBox, strict=False, z: int = 14):
+    """
+    get_tiles_in_bbox as (xs, ys) int arrays, for callers that only need the indices
+    (building a Tile model per tile costs far more than the tile math).
+    """
+    import numpy as np
+
+    xs, ys = lonlat_to_tile_batch([bbox.west, bbox.east], [bbox.north, bbox.south], z)
 
     # Clamp to valid tile indices
     n = 2**z
-    x_min = max(0, min(x_min, n - 1))
-    x_max = max(0, min(x_max, n - 1))
-    y_min = max(0, min(y_min, n - 1))
-    y_max = max(0, min(y_max, n - 1))
-
-    tiles = []
-    for x in range(min(x_min, x_max), max(x_min, x_max) + 1):
-        for y in range(min(y_min, y_max), max(y_min, y_max) + 1):
-            if strict and not tile_in_bbox(Tile(z=z, x=x, y=y), bbox):
-                continue
-            tiles.append(Tile(z=z, x=x, y=y))
-    return tiles
+    xs = np.clip(xs, 0, n - 1)
+    ys = np.clip(ys, 0, n - 1)
+
+    x_range = np.arange(xs.min(), xs.max() + 1)
+    y_range = np.arange(ys.min(), ys.max() + 1)
+    # x-outer, y-inner, same order as iterating x then y
+    grid_x = np.repeat(x_range, len(y_range))
+    grid_y = np.tile(y_range, len(x_range))
+    if strict:
+        mask = tiles_in_bbox_mask(grid_x, grid_y, z, bbox)
+        grid_x, grid_y = grid_x[mask], grid_y[mask]
+    return grid_x, grid_y
+
+
+# ----------------------------
+# NumPy batch versions of the tile and coordinate math above. Results match the scalar
+# functions element for element (see bench_map_utils.py); numpy is imported lazily.
+# ----------------------------
+def lonlat_to_tile_batch(lons, lats, z: int):
+    """lonlat_to_tile over arrays. Returns (xs, ys) int64 arrays."""
+    import numpy as np
+
+    lons = np.asarray(lons, dtype=np.float64)
+    lat_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    n = 2**z
+    x = (lons + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0 * n
+    # int() truncates toward zero, and so does astype
+    return x.astype(np.int64), y.astype(np.int64)
+
+
+def tiles_to_bboxes(xs, ys, z: int):
+    """tile_to_bbox over arrays. Returns (west, south, east, north) float arrays."""
+    import numpy as np
+
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    zoom_factor = 2**z
+    west = xs / zoom_factor * 360.0 - 180.0
+    east = (xs + 1) / zoom_factor * 360.0 - 180.0
+    north = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * ys / zoom_factor))))
+    south = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (ys + 1) / zoom_factor))))
+    return west, south, east, north
+
+
+def tiles_in_bbox_mask(xs, ys, z: int, bbox: BBox):
+    """tile_in_bbox over arrays: True where the tile lies fully inside bbox."""
+    west, south, east, north = tiles_to_bboxes(xs, ys, z)
+    return (
+        (west >= bbox.west)
+        & (east <= bbox.east)
+        & (south >= bbox.south)
+        & (north <= bbox.north)
+    )
+
+
+def project_coords_batch(coords, img_w: int, img_h: int, extent: int = 4096):
+    """project_coords over an (N, 2) array of MVT coords. Returns an (N, 2) float array."""
+    import numpy as np
+
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    sx, sy = img_w / extent, img_h / extent
+    out = np.empty_like(coords)
+    out[:, 0] = coords[:, 0] * sx
+    out[:, 1] = img_h - (coords[:, 1] * sy)
+    return out
+
+
+def clamp_boxes(boxes, W: int, H: int):
+    """clamp_box over an (N, 4) array of (xmin, ymin, xmax, ymax). Returns int64 (N, 4)."""
+    import numpy as np
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    # np.rint rounds half to even, like round()
+    r = np.rint(boxes).astype(np.int64)
+    r[:, 0::2] = np.clip(r[:, 0::2], 0, W - 1)
+    r[:, 1::2] = np.clip(r[:, 1::2], 0, H - 1)
+    out = np.empty_like(r)
+    out[:, 0] = np.minimum(r[:, 0], r[:, 2])
+    out[:, 2] = np.maximum(r[:, 0], r[:, 2])
+    out[:, 1] = np.minimum(r[:, 1], r[:, 3])
+    out[:, 3] = np.maximum(r[:, 1], r[:, 3])
+    return out
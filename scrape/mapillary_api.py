@@ -1,19 +1,23 @@
 import time
 import random
 import logging
-import io
 import os
 from typing import Any, Optional, Iterable
 import re
+from urllib.parse import parse_qs, urlparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import tqdm
 import requests
-from PIL import Image
-from vt2geojson.tools import vt_bytes_to_geojson
-import mapbox_vector_tile
 
 from config import MAP_CONFIG
+from concurrency import get_api_limiter, get_byte_budget
+import dead_letter
+from dead_letter import DeadLetterStore, record_failure
+from dedup import PerceptualDedup
+import response_cache
+from cpu_pool import run_cpu, decode_tile, parse_detection_bboxes, process_image_bytes
 from models import (
+    CandidateImage,
     MapillaryImage,
     MapillaryImageDetection,
     MapillaryImageCreator,
@@ -22,7 +26,7 @@ from models import (
     Tile,
     BBox,
 )
-from map_utils import decode_geometry, get_tiles_in_bbox, project_coords, clamp_box
+from map_utils import get_tiles_in_bbox
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +38,32 @@ def _backoff_sleep(attempt: int) -> None:
     time.sleep(MAP_CONFIG.RETRY_BASE_SLEEP * (2**attempt) + random.uniform(0, 0.5))
 
 
+def _api_get(url: str, **kwargs) -> requests.Response:
+    """
+    session.get() gated by the shared adaptive limiter.
+    429/5xx responses and transport errors count as overload; everything else as success.
+    """
+    return _api_request("get", url, **kwargs)
+
+
+def _api_head(url: str, **kwargs) -> requests.Response:
+    """session.head() gated by the shared adaptive limiter."""
+    return _api_request("head", url, **kwargs)
+
+
+def _api_request(method: str, url: str, **kwargs) -> requests.Response:
+    limiter = get_api_limiter()
+    probe = limiter.acquire()
+    start = time.monotonic()
+    ok = False
+    try:
+        r = getattr(MAP_CONFIG.session, method)(url, **kwargs)
+        ok = not (r.status_code == 429 or 500 <= r.status_code < 600)
+        return r
+    finally:
+        limiter.release(time.monotonic() - start, ok, probe)
+
+
 def _call_map_api(
     url: str, params: Optional[dict] = None, raw_bytes: bool = False
 ) -> tuple[str, Optional[dict]]:
@@ -46,7 +76,7 @@ def _call_map_api(
                 MAP_CONFIG.RETRY_TRIES,
                 url,
             )
-            r = MAP_CONFIG.session.get(url, params=params, timeout=30)
+            r = _api_get(url, params=params, timeout=30)
             code = r.status_code
             logger.debug("HTTP status code: %d", code)
             if code == 429 or 500 <= code < 600:
@@ -88,6 +118,44 @@ def _get_thumb_url(meta: dict[str, Any]) -> Optional[str]:
     )
 
 
+# treat signed thumbnail URLs as expired a little before their `oe` timestamp
+_URL_EXPIRY_MARGIN = 600
+_THUMB_FIELDS = "thumb_original_url,thumb_2048_url,thumb_1024_url,thumb_256_url"
+
+
+def _url_expiry(url: str) -> Optional[float]:
+    """Expiry (epoch seconds) of a signed CDN URL, from its hex `oe` parameter."""
+    oe = parse_qs(urlparse(url).query).get("oe")
+    try:
+        return int(oe[0], 16) if oe else None
+    except ValueError:
+        return None
+
+
+def _response_url_expiry(info: dict[str, Any]) -> Optional[float]:
+    """Earliest thumbnail URL expiry in a feature->images response, minus a margin."""
+    expiries = [
+        expiry
+        for imeta in (info.get("images") or {}).get("data", []) or []
+        for field in _THUMB_FIELDS.split(",")
+        if imeta.get(field)
+        for expiry in [_url_expiry(imeta[field])]
+        if expiry is not None
+    ]
+    return min(expiries) - _URL_EXPIRY_MARGIN if expiries else None
+
+
+def _refresh_image_url(image_id: int) -> Optional[str]:
+    """Ask the API for a fresh signed thumbnail URL of an image."""
+    r = _api_get(
+        f"https://graph.mapillary.com/{image_id}",
+        params={"fields": _THUMB_FIELDS},
+        timeout=60,
+    )
+    r.raise_for_status()
+    return _get_thumb_url(r.json())
+
+
 def _is_perspective_like(meta: dict[str, Any]) -> bool:
     """Filter out non-perspective (panos/fisheye/etc.)."""
     ct = str((meta or {}).get("camera_type", "")).lower()
@@ -109,78 +177,66 @@ def _is_perspective_like(meta: dict[str, Any]) -> bool:
     return True
 
 
-def _parse_mvt_bbox_coords_to_pixel_coords_bbox(
-    bbox: list[tuple[float, float]], image: MapillaryImage, extent: int = 4096
-) -> tuple[int, int, int, int]:
+def download_image(image: MapillaryImage) -> int:
     """
-    Parses the Map Vectory Tile (MVT) format bbox (originating at bottom-left (0,0))
-    to pixel coordinates (top-left (0,0)) and returns a tuple of representing the bounding box.
-    """
-    proj = project_coords(bbox, image.width, image.height, extent=extent)
-    xs = [p[0] for p in proj]
-    ys = [p[1] for p in proj]
-    xmin, xmax = min(xs), max(xs)
-    ymin, ymax = min(ys), max(ys)
-    bxmin, bymin, bxmax, bymax = clamp_box(
-        xmin, ymin, xmax, ymax, image.width, image.height
-    )
-    return bxmin, bymin, bxmax, bymax
-
+    Download an image from the Mapillary API.
+    Updates the image object in place: `image_bytes` holds the RGB JPEG to save and
+    width/height the real pixel size. Decoding/re-encoding runs on the CPU pool.
 
-def _parse_geometry_to_multiple_bboxes(
-    geometry: str, image: MapillaryImage
-) -> list[tuple[int, int, int, int]]:
-    """
-    Parse the detections geometry MVT to a list of pixel coordinate bounding boxes.
-    Each box is a tuple of (xmin, ymin, xmax, ymax).
+    The body is only read once its size (Content-Length, or DEFAULT_IMAGE_BYTES when
+    missing) fits in the global in-flight byte budget. Returns the number of bytes
+    reserved; the caller releases them once the image has been saved.
     """
-    decoded = decode_geometry(geometry)
-    if not decoded:
-        return []
-    boxes = []
-    for _, layer in decoded.items():
-        extent = layer.get("extent", 4096)
-        for feature in layer.get("features") or []:
-            geom = feature.get("geometry") or {}
-            if geom.get("type") != "Polygon":
-                continue
-            box = (geom.get("coordinates") or [[]])[0]
-            if not box:
-                continue
-
-            new_box = _parse_mvt_bbox_coords_to_pixel_coords_bbox(box, image, extent)
-            boxes.append(new_box)
-
-    return boxes
-
+    budget = get_byte_budget()
+    ir = _api_get(image.url, timeout=120, stream=True)
+    if ir.status_code in (403, 410):
+        # expired signature, e.g. a URL from a cached response or a dead-letter payload
+        ir.close()
+        url = _refresh_image_url(image.id)
+        if url:
+            image.url = url
+            ir = _api_get(image.url, timeout=120, stream=True)
+    reserved = 0
+    try:
+        ir.raise_for_status()
+        length = ir.headers.get("Content-Length", "")
+        reserved = budget.acquire(
+            int(length) if length.isdigit() else MAP_CONFIG.DEFAULT_IMAGE_BYTES
+        )
+        content = ir.content
+        budget.adjust(len(content) - reserved)
+        reserved = len(content)
 
-def download_image(image: MapillaryImage) -> None:
-    """
-    Download an image from the Mapillary API.
-    Updates the image object in place.
-    """
-    ir = MAP_CONFIG.session.get(image.url, timeout=120)
-    ir.raise_for_status()
-    image.image_bytes = ir.content
-    image.image = Image.open(io.BytesIO(ir.content)).convert("RGB")
-    image.width, image.height = image.image.size
+        image.image_bytes, image.width, image.height, phash = run_cpu(
+            process_image_bytes, content, MAP_CONFIG.DEDUP_MODE is not None
+        )
+    except BaseException:
+        budget.release(reserved)
+        raise
+    finally:
+        ir.close()
+    if phash is not None:
+        image.phash = f"{phash:016x}"
+    return reserved
 
 
 def get_detections_by_image(image: MapillaryImage) -> list[MapillaryImageDetection]:
     """
     Fetch detections in an image.
+    Raises requests.RequestException on failure so the caller can dead-letter the image.
     """
-    try:
+    cache = response_cache.get_cache()
+    dets_raw = cache.get(response_cache.IMAGE_DETECTIONS, image.id) if cache else None
+    if dets_raw is None:
         det_url = f"https://graph.mapillary.com/{image.id}/detections"
         det_params = {
             "fields": "id,value,geometry,image{id,creator}",
         }
-        dr = MAP_CONFIG.session.get(det_url, params=det_params, timeout=60)
+        dr = _api_get(det_url, params=det_params, timeout=60)
         dr.raise_for_status()
         dets_raw = dr.json().get("data", []) or []
-    except requests.RequestException as e:
-        logger.warning("detections fetch failed for image %s: %s", image.id, e)
-        return []
+        if cache:
+            cache.put(response_cache.IMAGE_DETECTIONS, image.id, dets_raw)
     if not dets_raw:
         return []
 
@@ -205,15 +261,30 @@ def get_detections_by_image(image: MapillaryImage) -> list[MapillaryImageDetecti
     return dets
 
 
-def get_candidate_images(id_results: list[TrafficSignFeature]) -> list[MapillaryImage]:
+def get_candidate_images(id_results: list[TrafficSignFeature]) -> list[CandidateImage]:
     """
     For each feature id:
       - fetch up to MAX_IMAGES_PER_ID images
       - keep perspective-like images
-    Returns: [{id, url, lat, lon}, ...]
+    Returns: [CandidateImage(id, url, lat, lon, ...), ...]
+    """
+    return _resolve_candidates(id_results)[0]
+
+
+def _resolve_candidates(
+    id_results: list[TrafficSignFeature],
+    track_features: bool = False,
+) -> tuple[list[CandidateImage], Optional[dict[int, list[int]]], set[int]]:
     """
-    candidates: list[MapillaryImage] = []
+    get_candidate_images() that also reports which features failed to resolve and,
+    with track_features (incremental state), which features each candidate came from.
+    Returns: (candidates, {image id: [feature id, ...]} or None, failed feature ids)
+    """
+    candidates: list[CandidateImage] = []
     candidate_ids: set[int] = set()
+    image_features: Optional[dict[int, list[int]]] = {} if track_features else None
+    failed_features: set[int] = set()
+    cache = response_cache.get_cache()
     for feat in tqdm.tqdm(
         id_results,
         total=len(id_results),
@@ -229,12 +300,26 @@ def get_candidate_images(id_results: list[TrafficSignFeature]) -> list[Mapillary
                     "id,object_value,"
                     f"images.limit({MAP_CONFIG.MAX_IMAGES_PER_ID})"
                     "{id,camera_type,is_pano,width,height,sequence,"
-                    "thumb_original_url,thumb_2048_url,thumb_1024_url,thumb_256_url}"
+                    f"{_THUMB_FIELDS}}}"
                 ),
             }
-            r = MAP_CONFIG.session.get(feat_url, params=feat_params, timeout=60)
-            r.raise_for_status()
-            info = r.json()
+            # the fields string includes the images limit, so it is part of the key
+            cache_key = f"{fid}:{feat_params['fields']}"
+            info = (
+                cache.get(response_cache.FEATURE_IMAGES, cache_key) if cache else None
+            )
+            if info is None:
+                r = _api_get(feat_url, params=feat_params, timeout=60)
+                r.raise_for_status()
+                info = r.json()
+                if cache:
+                    # the thumbnail URLs are signed; don't serve them past their expiry
+                    cache.put(
+                        response_cache.FEATURE_IMAGES,
+                        cache_key,
+                        info,
+                        expires_at=_response_url_expiry(info),
+                    )
 
             for imeta in (info.get("images") or {}).get("data", []) or []:
                 if not _is_perspective_like(imeta):
@@ -243,8 +328,10 @@ def get_candidate_images(id_results: list[TrafficSignFeature]) -> list[Mapillary
                 if not url:
                     continue
 
+                if image_features is not None:
+                    image_features.setdefault(imeta["id"], []).append(fid)
                 if not imeta["id"] in candidate_ids:
-                    candidate = MapillaryImage(
+                    candidate = CandidateImage(
                         id=imeta["id"],
                         url=url,
                         camera_type=imeta["camera_type"],
@@ -260,34 +347,88 @@ def get_candidate_images(id_results: list[TrafficSignFeature]) -> list[Mapillary
 
         except requests.RequestException as e:
             logger.warning("feature %s fetch failed: %s", fid, e)
+            record_failure(dead_letter.FEATURE, fid, feat.model_dump(), str(e))
+            failed_features.add(fid)
             time.sleep(MAP_CONFIG.SLEEP_BETWEEN_PAGES)
-    return candidates
+    return candidates, image_features, failed_features
 
 
 def _save_image_with_detections(
-    image: MapillaryImage, output_dir: str, json_only=False
-) -> None:
+    candidate: CandidateImage,
+    output_dir: str,
+    json_only=False,
+    dedup: Optional[PerceptualDedup] = None,
+) -> bool:
+    """
+    Fetch, box and save one candidate. Returns True if it was saved, False if it was
+    skipped (no traffic sign detections, near-duplicate). Fetch errors are raised for
+    the caller to dead-letter.
+    """
+    image = candidate.to_image()
     dets = get_detections_by_image(image)
     dets = [det for det in dets if re.match(TRAFFIC_SIGN_REGEX, det.value)]
 
     if not dets:
         logger.warning("no detections found for %s", image.id)
-        return
-
-    if not json_only:
-        download_image(image)
-        logger.debug(
-            "Image %s downloaded, size: %dx%d", image.id, image.width, image.height
-        )
+        return False
 
-    for det in dets:
-        detection_bboxes = _parse_geometry_to_multiple_bboxes(det.geometry, image)
+    reserved = 0
+    try:
+        if not json_only:
+            reserved = download_image(image)
+            logger.debug(
+                "Image %s downloaded, size: %dx%d", image.id, image.width, image.height
+            )
+            if dedup is not None and image.phash is not None:
+                duplicate_of = dedup.check(image.id, int(image.phash, 16))
+                if duplicate_of is not None:
+                    if dedup.mode == "skip":
+                        logger.info(
+                            "skipping image %s, near-duplicate of %s",
+                            image.id,
+                            duplicate_of,
+                        )
+                        dedup.record_skip(image.id, duplicate_of)
+                        return False
+                    image.duplicate_of = duplicate_of
+
+        _add_detection_bboxes(image, dets)
+
+        if not json_only:
+            image.save_image_and_detections(f"{output_dir}/{image.id}")
+        else:
+            image.save_detections(f"{output_dir}/{image.id}/{image.id}.json")
+        if dedup is not None:
+            # only saved images go into the index, so a failed one can't match itself later
+            dedup.commit(image.id)
+        # clear out to save mem when processing huge amounts of images
+        image.image_bytes = None
+        return True
+    finally:
+        if dedup is not None:
+            dedup.discard(image.id)
+        # frees this download's share of the in-flight byte budget
+        get_byte_budget().release(reserved)
+
+
+def _add_detection_bboxes(
+    image: MapillaryImage, dets: list[MapillaryImageDetection]
+) -> None:
+    """Project each detection's geometry to pixel boxes and attach one detection per box."""
+    # decode all geometries for this image in one CPU pool round trip
+    bboxes_per_det = run_cpu(
+        parse_detection_bboxes,
+        [det.geometry for det in dets],
+        image.width,
+        image.height,
+    )
+    for det, detection_bboxes in zip(dets, bboxes_per_det):
         if not detection_bboxes:
             continue
 
         for detection_bbox in detection_bboxes:
             image.detections.append(
-                MapillaryImageDetection(
+                MapillaryImageDetection.construct_trusted(
                     id=det.id,
                     value=det.value,
                     geometry=det.geometry,
@@ -296,19 +437,12 @@ def _save_image_with_detections(
                 )
             )
 
-    if not json_only:
-        image.save_image_and_detections(f"{output_dir}/{image.id}")
-    else:
-        image.save_detections(f"{output_dir}/{image.id}/{image.id}.json")
-    # clear out to save mem when processing huge amounts of images
-    image.image = None
-    image.image_bytes = None
-
 
 def save_images_with_detections_by_id(
     id_results: list[TrafficSignFeature],
     output_dir: str = "images",
     json_only: bool = False,
+    failed_feature_ids: Optional[set[int]] = None,
 ) -> int:
     """
     For each feature id:
@@ -317,6 +451,8 @@ def save_images_with_detections_by_id(
       - fetch detections and keep only those with values in `classes`
       - download best-available thumbnail and convert polygon => (xmin, ymin, xmax, ymax) pixels
       - save images and detections to disk in batches to manage memory
+    If `failed_feature_ids` is given, it is filled with the ids of features whose image
+    lookup failed or that have a candidate image which failed to save.
     Returns: number of images saved
     """
 
@@ -325,40 +461,83 @@ def save_images_with_detections_by_id(
         k, m = divmod(len(lst), n)
         return [lst[i * k + min(i, m) : (i + 1) * k + min(i + 1, m)] for i in range(n)]
 
-    num_chunks = MAP_CONFIG.MAX_CONCURRENT_WORKERS
+    num_chunks = MAP_CONFIG.MAX_ADAPTIVE_WORKERS
     id_chunks = chunkify(id_results, num_chunks)
 
-    # get candidate images
-    candidates: list[MapillaryImage] = []
-    with ThreadPoolExecutor(max_workers=MAP_CONFIG.MAX_CONCURRENT_WORKERS) as executor:
-        futures = [executor.submit(get_candidate_images, chunk) for chunk in id_chunks]
+    # get candidate images; the image => features map is only needed to report failures
+    track_features = failed_feature_ids is not None
+    candidates: list[CandidateImage] = []
+    image_features: dict[int, list[int]] = {}
+    failed_features: set[int] = set()
+    with ThreadPoolExecutor(max_workers=MAP_CONFIG.MAX_ADAPTIVE_WORKERS) as executor:
+        futures = [
+            executor.submit(_resolve_candidates, chunk, track_features)
+            for chunk in id_chunks
+        ]
         for future in tqdm.tqdm(
             as_completed(futures),
             total=len(futures),
             desc=f"Getting candidate images in chunks of size {num_chunks}",
             unit="chunk",
         ):
-            result = future.result()
-            if result:
-                candidates.extend(result)
+            chunk_candidates, chunk_image_features, chunk_failed = future.result()
+            candidates.extend(chunk_candidates)
+            failed_features.update(chunk_failed)
+            if chunk_image_features is not None:
+                for image_id, fids in chunk_image_features.items():
+                    image_features.setdefault(image_id, []).extend(fids)
 
     logger.info(
         "Found %d unique candidate images for %d ids", len(candidates), len(id_results)
     )
+    saved, failed_images = _save_candidates(candidates, output_dir, json_only)
+    if failed_feature_ids is not None:
+        failed_feature_ids.update(failed_features)
+        for image_id in failed_images:
+            failed_feature_ids.update(image_features.get(image_id, ()))
+    return saved
+
 
+def save_candidate_images(
+    candidates: list[CandidateImage],
+    output_dir: str = "images",
+    json_only: bool = False,
+) -> int:
+    """
+    Fetch detections for each candidate not already in output_dir, download it and save
+    image + detections. Failures are recorded in the dead-letter store.
+    Returns: number of images saved
+    """
+    return _save_candidates(candidates, output_dir, json_only)[0]
+
+
+def _save_candidates(
+    candidates: list[CandidateImage], output_dir: str, json_only: bool
+) -> tuple[int, set[int]]:
+    """save_candidate_images() that also returns the ids of the images that failed."""
     existing_image_set = set()
     for entry in os.listdir(output_dir):
         existing_image_set.add(entry)
     logger.info("%d existing images", len(existing_image_set))
     candidates = [cand for cand in candidates if str(cand.id) not in existing_image_set]
+
+    dedup = None
+    if MAP_CONFIG.DEDUP_MODE and not json_only:
+        dedup = PerceptualDedup(
+            output_dir, MAP_CONFIG.DEDUP_MAX_DISTANCE, MAP_CONFIG.DEDUP_MODE
+        )
+        if dedup.mode == "skip":
+            # near-duplicates skipped by earlier runs would only be skipped again
+            candidates = [cand for cand in candidates if cand.id not in dedup.skipped]
     logger.info("found %d new candidate images", len(candidates))
 
     # get detections and their bboxes in each candidate image
     saved = 0
-    with ThreadPoolExecutor(max_workers=MAP_CONFIG.MAX_CONCURRENT_WORKERS) as executor:
+    failed: set[int] = set()
+    with ThreadPoolExecutor(max_workers=MAP_CONFIG.MAX_ADAPTIVE_WORKERS) as executor:
         future_to_cand = {
             executor.submit(
-                _save_image_with_detections, cand, output_dir, json_only
+                _save_image_with_detections, cand, output_dir, json_only, dedup
             ): cand
             for cand in candidates
         }
@@ -369,14 +548,16 @@ def save_images_with_detections_by_id(
             unit="image",
         ):
             cand = future_to_cand[future]
-            if cand:
-                saved += 1
-                # clear image from memory
-                cand.image = None
-                cand.image_bytes = None
+            try:
+                if future.result():
+                    saved += 1
+            except Exception as e:
+                logger.warning("saving image %s failed: %s", cand.id, e)
+                record_failure(dead_letter.IMAGE, cand.id, cand.to_dict(), repr(e))
+                failed.add(cand.id)
 
     logger.info("Saved %d images with detections", saved)
-    return saved
+    return saved, failed
 
 
 def filter_only_traffic_sign_features(
@@ -406,19 +587,25 @@ def get_valid_ids_in_tile(
     logger.debug("request_url: %s", request_url)
     status, data = _call_map_api(request_url, raw_bytes=True)
     logger.debug("completed call_map_api, status: %s", status)
-    if status != "ok" or not data:
+    if status != "ok":
+        record_failure(
+            dead_letter.TILE, str(tile), tile.model_dump(), f"tile request {status}"
+        )
+        return out
+    if not data:
         return out  # return what we have
 
-    geojson_data = vt_bytes_to_geojson(data, tile.x, tile.y, tile.z)
-    logger.debug("Converted MVT to GeoJSON")
-
-    mvt_repr = mapbox_vector_tile.decode(data)
-    if "water" in mvt_repr:
+    geojson_data = run_cpu(decode_tile, data, tile.x, tile.y, tile.z)
+    if geojson_data is None:
         logger.warning("tile %s is empty", str(tile))
-        # this is the representation of the tile when it is empty. wtf mapillary??
         return []
+    logger.debug("Converted MVT to GeoJSON")
 
-    mapbox_tile = MapboxTile.model_validate(geojson_data)
+    # the shape check keeps malformed tiles on the validating path
+    if MAP_CONFIG.TRUST_TILE_FEATURES and MapboxTile.has_trusted_shape(geojson_data):
+        mapbox_tile = MapboxTile.construct_trusted(geojson_data)
+    else:
+        mapbox_tile = MapboxTile.model_validate(geojson_data)
     logger.info("found %d features for tile %s", len(mapbox_tile.features), str(tile))
 
     if classes:
@@ -439,19 +626,81 @@ def get_valid_ids_in_bbox(
 
     Returns a de-duplicated list of features across all tiles.
     """
-    tiles = get_tiles_in_bbox(bbox, strict=strict)
+    return get_valid_ids_in_tiles(get_tiles_in_bbox(bbox, strict=strict), classes)
+
+
+def get_valid_ids_in_tiles(
+    tiles: list[Tile], classes: Iterable[str] = None
+) -> list[TrafficSignFeature]:
+    """Aggregate traffic sign features over a list of tiles, de-duplicated by id."""
     seen_ids: set[int] = set()
     results: list[TrafficSignFeature] = []
 
-    for tile_coords_item in tqdm.tqdm(
-        tiles, desc="Getting features in tiles", unit="tile"
-    ):
-        feats = get_valid_ids_in_tile(tile_coords_item, classes)
-        for f in feats:
-            if f.id in seen_ids:
-                continue
-            seen_ids.add(f.id)
-            results.append(f)
+    def fetch_tile(tile: Tile) -> list[TrafficSignFeature]:
+        feats = get_valid_ids_in_tile(tile, classes)
         time.sleep(MAP_CONFIG.SLEEP_BETWEEN_PAGES)
+        return feats
+
+    # tiles are fetched on threads while their MVT decoding runs on the CPU pool;
+    # map() keeps tile order so de-duplication is deterministic
+    with ThreadPoolExecutor(max_workers=MAP_CONFIG.MAX_ADAPTIVE_WORKERS) as executor:
+        for feats in tqdm.tqdm(
+            executor.map(fetch_tile, tiles),
+            total=len(tiles),
+            desc="Getting features in tiles",
+            unit="tile",
+        ):
+            for f in feats:
+                if f.id in seen_ids:
+                    continue
+                seen_ids.add(f.id)
+                results.append(f)
 
     return results
+
+
+def replay_failures(
+    store: DeadLetterStore, output_dir: str = "images", json_only: bool = False
+) -> int:
+    """
+    Retry only the items recorded in the dead-letter store:
+      - failed tiles are re-fetched and their features resolved
+      - failed features are resolved to candidate images again
+      - failed images are re-fetched and saved
+    Entries that go through without a new failure are removed; the rest keep their
+    bumped attempt count. Returns: number of images saved
+    """
+    tile_entries = store.pending(dead_letter.TILE)
+    feature_entries = store.pending(dead_letter.FEATURE)
+    image_entries = store.pending(dead_letter.IMAGE)
+    logger.info(
+        "replaying %d tiles, %d features, %d images",
+        len(tile_entries),
+        len(feature_entries),
+        len(image_entries),
+    )
+
+    features: dict[int, TrafficSignFeature] = {}
+    for entry in tile_entries:
+        for feat in get_valid_ids_in_tile(Tile.model_validate(entry.payload)):
+            features.setdefault(feat.id, feat)
+        store.resolve_if_retried_ok(entry)
+    for entry in feature_entries:
+        feat = TrafficSignFeature.model_validate(entry.payload)
+        features.setdefault(feat.id, feat)
+
+    candidates = get_candidate_images(list(features.values()))
+    for entry in feature_entries:
+        store.resolve_if_retried_ok(entry)
+
+    candidate_ids = {cand.id for cand in candidates}
+    for entry in image_entries:
+        cand = CandidateImage(**entry.payload)
+        if cand.id not in candidate_ids:
+            candidates.append(cand)
+            candidate_ids.add(cand.id)
+
+    saved = save_candidate_images(candidates, output_dir, json_only)
+    for entry in image_entries:
+        store.resolve_if_retried_ok(entry)
+    return saved
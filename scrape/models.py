@@ -1,10 +1,15 @@
+import sys
 from typing import Any
 from pydantic import BaseModel, Field
 from dataclasses import dataclass
-from PIL import Image
 from pathlib import Path
 import json
 
+try:
+    import orjson
+except ImportError:  # optional; falls back to the stdlib json writer
+    orjson = None
+
 
 class Tile(BaseModel):
     z: int
@@ -26,6 +31,19 @@ class BBox(BaseModel):
         return (self.west, self.south, self.east, self.north)
 
 
+def _construct(cls, values: dict, fields_set: set):
+    """
+    What `model_construct` does for a model with every field given and no private
+    attributes, without its per-field default handling (about 4x faster).
+    """
+    obj = object.__new__(cls)
+    object.__setattr__(obj, "__dict__", values)
+    object.__setattr__(obj, "__pydantic_fields_set__", fields_set)
+    object.__setattr__(obj, "__pydantic_extra__", None)
+    object.__setattr__(obj, "__pydantic_private__", None)
+    return obj
+
+
 # ----------------------------
 # Pydantic Models
 # ----------------------------
@@ -61,11 +79,93 @@ class TrafficSignFeature(BaseModel):
         """Get latitude (second coordinate in GeoJSON format)."""
         return self.geometry.coordinates[1]
 
+    @classmethod
+    def construct_trusted(cls, feature: dict) -> "TrafficSignFeature":
+        """Build from a vt2geojson feature dict without validation."""
+        geometry = feature["geometry"]
+        props = feature["properties"]
+        return _construct(
+            cls,
+            {
+                "geometry": _construct(
+                    PointGeometry,
+                    {
+                        "type": geometry.get("type", "Point"),
+                        "coordinates": tuple(geometry["coordinates"]),
+                    },
+                    {"type", "coordinates"},
+                ),
+                "properties": _construct(
+                    TrafficSignProperties,
+                    {
+                        "first_seen_at": props["first_seen_at"],
+                        "id": props["id"],
+                        "last_seen_at": props["last_seen_at"],
+                        "value": props["value"],
+                    },
+                    {"first_seen_at", "id", "last_seen_at", "value"},
+                ),
+                "type": feature.get("type", "Feature"),
+            },
+            {"geometry", "properties", "type"},
+        )
+
 
 class MapboxTile(BaseModel):
     type: str = Field(default="FeatureCollection")
     features: list[TrafficSignFeature] = Field(default_factory=list)
 
+    @staticmethod
+    def has_trusted_shape(geojson: dict) -> bool:
+        """
+        Cheap structural check of decoded tile output: every feature is a dict with a
+        `type`, a 2-coordinate `geometry` and `properties` carrying an int `id`, int
+        timestamps and a str `value`. Much cheaper than validating each feature.
+        """
+        features = geojson.get("features")
+        if features is None:
+            return True
+        if type(features) is not list:
+            return False
+        for f in features:
+            if type(f) is not dict or "type" not in f:
+                return False
+            geometry, props = f.get("geometry"), f.get("properties")
+            if type(geometry) is not dict or type(props) is not dict:
+                return False
+            coords = geometry.get("coordinates")
+            if type(coords) not in (list, tuple) or len(coords) != 2:
+                return False
+            if not all(type(c) in (int, float) for c in coords):
+                return False
+            if (
+                type(props.get("id")) is not int
+                or type(props.get("first_seen_at")) is not int
+                or type(props.get("last_seen_at")) is not int
+                or type(props.get("value")) is not str
+            ):
+                return False
+        return True
+
+    @classmethod
+    def construct_trusted(cls, geojson: dict) -> "MapboxTile":
+        """
+        Build from vt2geojson output without running pydantic validation.
+        Only use on data that passes `has_trusted_shape`; `model_validate` is the
+        checked path.
+        """
+        return _construct(
+            cls,
+            {
+                "type": geojson.get("type", "FeatureCollection"),
+                "features": [
+                    TrafficSignFeature.construct_trusted(f)
+                    for f in geojson.get("features") or []
+                ],
+            },
+            {"type", "features"},
+        )
+
 
 class MapillaryImageCreator(BaseModel):
     id: int
@@ -87,6 +187,20 @@ class MapillaryImageDetection(BaseModel):
     # should always be a child of a MapillaryImage, but in case something goes wrong, we'll have it
     image_id: int
 
+    @classmethod
+    def construct_trusted(
+        cls,
+        id: int,
+        value: str,
+        geometry: str,
+        image_id: int,
+        bbox: tuple[int, int, int, int] = None,
+    ) -> "MapillaryImageDetection":
+        """Build without validation, e.g. when copying fields from an already validated detection."""
+        return cls.model_construct(
+            id=id, value=value, geometry=geometry, bbox=bbox, image_id=image_id
+        )
+
 
 class MapillaryImage(BaseModel):
     id: int
@@ -101,25 +215,31 @@ class MapillaryImage(BaseModel):
     height: int = None
     sequence: str = None
     detections: list[MapillaryImageDetection] = Field(default_factory=list)
+    # only set (and written) when perceptual de-duplication is enabled
+    phash: str = None
+    duplicate_of: int = None
 
     def save_image(self, path: str) -> None:
         path = Path(path)
         path.parent.mkdir(parents=True, exist_ok=True)
 
-        if self.image and isinstance(self.image, Image.Image):
-            self.image.save(path)
-        else:
-            with open(path, "wb") as f:
-                f.write(self.image_bytes)
+        # images are re-encoded to JPEG bytes on the CPU pool (cpu_pool.process_image_bytes)
+        with open(path, "wb") as f:
+            f.write(self.image_bytes)
 
     def save_detections(self, path: str) -> None:
         path = Path(path)
         path.parent.mkdir(parents=True, exist_ok=True)
 
-        dump = self.model_dump()
-        # pop image_bytes and image
-        dump.pop("image_bytes")
-        dump.pop("image")
+        exclude = {"image_bytes", "image"}
+        exclude.update(k for k in ("phash", "duplicate_of") if getattr(self, k) is None)
+        dump = self.model_dump(exclude=exclude)
+        if orjson is not None:
+            # same layout as json.dump(indent=2); non-ASCII is written as UTF-8 instead of \u escapes
+            with open(path, "wb") as f:
+                f.write(orjson.dumps(dump, option=orjson.OPT_INDENT_2))
+            return
+
         with open(path, "w", encoding="utf-8") as f:
             json.dump(
                 dump,
@@ -130,3 +250,65 @@ class MapillaryImage(BaseModel):
     def save_image_and_detections(self, dir_path: str) -> None:
         self.save_image(f"{dir_path}/{self.id}.jpg")
         self.save_detections(f"{dir_path}/{self.id}.json")
+
+
+class CandidateImage:
+    """
+    Lightweight record of a candidate image found while resolving features.
+
+    A large scrape holds hundreds of thousands of candidates at once, so this stays a plain
+    `__slots__` object (about a quarter of the memory of a `MapillaryImage`, see
+    bench_candidates.py) and is only turned into the full model with `to_image()` when
+    the image is actually processed.
+    """
+
+    __slots__ = (
+        "id",
+        "url",
+        "camera_type",
+        "lat",
+        "lon",
+        "sequence",
+        "width",
+        "height",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        url: str,
+        camera_type: str,
+        lat: float,
+        lon: float,
+        sequence: str = None,
+        width: int = None,
+        height: int = None,
+    ):
+        self.id = int(id)
+        self.url = url
+        # only a handful of distinct camera types; share the strings
+        self.camera_type = sys.intern(camera_type)
+        self.lat = float(lat)
+        self.lon = float(lon)
+        self.sequence = str(sequence) if sequence is not None else None
+        self.width = int(width) if width is not None else None
+        self.height = int(height) if height is not None else None
+
+    def __repr__(self) -> str:
+        return f"CandidateImage(id={self.id})"
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def to_image(self) -> MapillaryImage:
+        # every field was coerced to its model type in __init__, skip re-validation
+        return MapillaryImage.model_construct(
+            id=self.id,
+            url=self.url,
+            camera_type=self.camera_type,
+            lat=self.lat,
+            lon=self.lon,
+            sequence=self.sequence,
+            width=self.width,
+            height=self.height,
+        )
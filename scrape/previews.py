@@ -0,0 +1,302 @@
+"""
+Render annotated previews for a scrape output directory.
+
+Each `<output_dir>/<id>/<id>.jpg` + `<id>.json` pair is drawn with its detection boxes,
+downscaled, and written to `<preview_dir>/<id>.jpg` across a process pool. Previews are
+then tiled into paged contact sheets (`sheet_001.jpg`, ...) with a matching HTML page per
+sheet and an `index.html`. Previews and sheets that are already newer than their inputs
+are skipped, so re-running after a scrape only renders what changed.
+
+Usage:
+    python previews.py images --preview-dir images_previews --workers 8
+"""
+
+import argparse
+import html
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import tqdm
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_SIZE = 512
+CAPTION_HEIGHT = 20
+SHEET_COLUMNS = 5
+SHEET_ROWS = 4
+MANIFEST_NAME = "sheets.json"
+
+
+def _list_image_entries(output_dir: str) -> list[tuple[str, str, str]]:
+    """Return sorted (image_id, jpg_path, json_path) for every complete image entry."""
+    entries = []
+    for entry in os.listdir(output_dir):
+        entry_path = os.path.join(output_dir, entry)
+        if not os.path.isdir(entry_path):
+            continue
+        jpg_path = os.path.join(entry_path, f"{entry}.jpg")
+        json_path = os.path.join(entry_path, f"{entry}.json")
+        if os.path.isfile(jpg_path) and os.path.isfile(json_path):
+            entries.append((entry, jpg_path, json_path))
+    entries.sort()
+    return entries
+
+
+def _is_current(target: str, *sources: str) -> bool:
+    """True if target exists and is at least as new as every source."""
+    try:
+        target_mtime = os.path.getmtime(target)
+    except OSError:
+        return False
+    return all(os.path.getmtime(src) <= target_mtime for src in sources)
+
+
+def render_preview(
+    jpg_path: str, json_path: str, preview_path: str, size: int = PREVIEW_SIZE
+) -> str:
+    """
+    Draw detection boxes and labels on an image and save a downscaled copy.
+    Runs in a worker process. Returns the preview path.
+    """
+    from PIL import Image, ImageDraw
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        img_data = json.load(f)
+
+    detections = [d for d in img_data.get("detections", []) if d.get("bbox")]
+    with Image.open(jpg_path) as im:
+        im = im.convert("RGB")
+        full_width = im.width
+        # keep boxes visible after downscaling
+        line_width = max(2, round(3 * max(im.size) / size))
+        draw = ImageDraw.Draw(im)
+        for det in detections:
+            draw.rectangle(det["bbox"], outline="magenta", width=line_width)
+
+        # labels are drawn after downscaling so they stay legible
+        im.thumbnail((size, size))
+        scale = im.width / full_width
+        draw = ImageDraw.Draw(im)
+        for det in detections:
+            x1, y1 = det["bbox"][0] * scale, det["bbox"][1] * scale
+            draw.text((x1, max(0, y1 - 12)), det.get("value", ""), fill="magenta")
+        Path(preview_path).parent.mkdir(parents=True, exist_ok=True)
+        im.save(preview_path, quality=85)
+    return preview_path
+
+
+def _render_preview_task(args: tuple[str, str, str, int]) -> Optional[str]:
+    """Render one preview. Returns an error message instead of raising, so one bad entry
+    doesn't abort the pool."""
+    try:
+        render_preview(*args)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def _caption(json_path: str) -> str:
+    """Same summary the interactive viewer puts in the title."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        img_data = json.load(f)
+    creator = img_data.get("creator") or {}
+    classes = sorted({d.get("value") for d in img_data.get("detections", [])})
+    return (
+        f"{', '.join(classes)} | {img_data.get('sequence')} "
+        f"{creator.get('username')} ({creator.get('id')}) | "
+        f"({img_data.get('lat')}, {img_data.get('lon')})"
+    )
+
+
+def _build_contact_sheet(sheet_path: str, preview_paths: list[tuple[str, str]]) -> None:
+    from PIL import Image, ImageDraw
+
+    cell_h = PREVIEW_SIZE + CAPTION_HEIGHT
+    rows = -(-len(preview_paths) // SHEET_COLUMNS)
+    sheet = Image.new("RGB", (SHEET_COLUMNS * PREVIEW_SIZE, rows * cell_h), "white")
+    draw = ImageDraw.Draw(sheet)
+    for i, (image_id, preview_path) in enumerate(preview_paths):
+        col, row = i % SHEET_COLUMNS, i // SHEET_COLUMNS
+        x0, y0 = col * PREVIEW_SIZE, row * cell_h
+        with Image.open(preview_path) as thumb:
+            sheet.paste(
+                thumb,
+                (
+                    x0 + (PREVIEW_SIZE - thumb.width) // 2,
+                    y0 + (PREVIEW_SIZE - thumb.height) // 2,
+                ),
+            )
+        draw.text((x0 + 4, y0 + PREVIEW_SIZE + 4), image_id, fill="black")
+    sheet.save(sheet_path, quality=85)
+
+
+def _write_sheet_html(
+    html_path: str, sheet_name: str, rows: list[tuple[str, str, str]]
+) -> None:
+    cells = "\n".join(
+        f'<a href="{html.escape(jpg)}" title="{html.escape(caption)}">'
+        f'<img src="{html.escape(image_id)}.jpg" loading="lazy"></a>'
+        for image_id, jpg, caption in rows
+    )
+    with open(html_path, "w", encoding="utf-8") as f:
+        f.write(
+            f"<!doctype html><html><head><meta charset='utf-8'><title>{sheet_name}</title>"
+            "<style>img{max-width:256px;margin:2px}</style></head><body>"
+            f'<p><a href="index.html">index</a></p>{cells}</body></html>'
+        )
+
+
+def build_contact_sheets(
+    entries: list[tuple[str, str, str]], preview_dir: str, per_page: int
+) -> int:
+    """
+    Tile previews into paged contact sheets and HTML pages.
+    A page is only rebuilt when its member images changed or a member preview is newer.
+    Returns the number of sheets rebuilt.
+    """
+    manifest_path = os.path.join(preview_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    pages = [entries[i : i + per_page] for i in range(0, len(entries), per_page)]
+    new_manifest = {}
+    rebuilt = 0
+    for page_no, page in enumerate(pages, start=1):
+        sheet_name = f"sheet_{page_no:03d}"
+        sheet_path = os.path.join(preview_dir, f"{sheet_name}.jpg")
+        html_path = os.path.join(preview_dir, f"{sheet_name}.html")
+        ids = [image_id for image_id, _, _ in page]
+        previews = [os.path.join(preview_dir, f"{image_id}.jpg") for image_id in ids]
+        new_manifest[sheet_name] = ids
+
+        if manifest.get(sheet_name) == ids and _is_current(sheet_path, *previews):
+            continue
+
+        _build_contact_sheet(sheet_path, list(zip(ids, previews)))
+        _write_sheet_html(
+            html_path,
+            sheet_name,
+            [
+                (image_id, os.path.relpath(jpg, preview_dir), _caption(json_path))
+                for image_id, jpg, json_path in page
+            ],
+        )
+        rebuilt += 1
+
+    # pages past the new last page are left over from a larger run
+    for sheet_name in set(manifest) - set(new_manifest):
+        for ext in ("jpg", "html"):
+            try:
+                os.remove(os.path.join(preview_dir, f"{sheet_name}.{ext}"))
+            except FileNotFoundError:
+                pass
+
+    with open(os.path.join(preview_dir, "index.html"), "w", encoding="utf-8") as f:
+        links = "\n".join(
+            f'<li><a href="{name}.html">{name}</a> '
+            f'(<a href="{name}.jpg">contact sheet</a>, {len(ids)} images)</li>'
+            for name, ids in new_manifest.items()
+        )
+        f.write(
+            "<!doctype html><html><head><meta charset='utf-8'><title>Previews</title>"
+            f"</head><body><p>{len(entries)} images</p><ul>{links}</ul></body></html>"
+        )
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(new_manifest, f)
+    return rebuilt
+
+
+def render_previews(
+    output_dir: str,
+    preview_dir: str,
+    workers: int = None,
+    per_page: int = SHEET_COLUMNS * SHEET_ROWS,
+) -> int:
+    """
+    Render annotated previews for every image in output_dir across a process pool,
+    then build contact sheets and the HTML index in preview_dir.
+    Returns the number of previews rendered (stale or missing ones only).
+    Entries that fail to render are logged and left out of the sheets.
+    """
+    os.makedirs(preview_dir, exist_ok=True)
+    entries = _list_image_entries(output_dir)
+
+    tasks = []
+    task_ids = []
+    for image_id, jpg_path, json_path in entries:
+        preview_path = os.path.join(preview_dir, f"{image_id}.jpg")
+        if _is_current(preview_path, jpg_path, json_path):
+            continue
+        tasks.append((jpg_path, json_path, preview_path, PREVIEW_SIZE))
+        task_ids.append(image_id)
+    logger.info(
+        "%d images, %d previews up to date", len(entries), len(entries) - len(tasks)
+    )
+
+    failed = set()
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for image_id, error in zip(
+                task_ids,
+                tqdm.tqdm(
+                    executor.map(_render_preview_task, tasks, chunksize=8),
+                    total=len(tasks),
+                    desc="Rendering previews",
+                    unit="image",
+                ),
+            ):
+                if error is not None:
+                    logger.warning(
+                        "could not render preview for %s: %s", image_id, error
+                    )
+                    failed.add(image_id)
+
+    # unreadable images are left out of the sheets
+    entries = [entry for entry in entries if entry[0] not in failed]
+    sheets = build_contact_sheets(entries, preview_dir, per_page)
+    logger.info("rebuilt %d contact sheets", sheets)
+    return len(tasks) - len(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render annotated previews and contact sheets for a scrape output directory"
+    )
+    parser.add_argument(
+        "output_dir", help="Scrape output directory (images/<id>/<id>.jpg)"
+    )
+    parser.add_argument(
+        "--preview-dir",
+        type=str,
+        help="Where to write previews (default: <output_dir>_previews)",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Number of worker processes (default: CPU count)"
+    )
+    parser.add_argument(
+        "--per-page",
+        type=int,
+        default=SHEET_COLUMNS * SHEET_ROWS,
+        help="Images per contact sheet",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    preview_dir = args.preview_dir or f"{args.output_dir.rstrip('/')}_previews"
+    rendered = render_previews(
+        args.output_dir, preview_dir, args.workers, args.per_page
+    )
+    print(
+        f"Rendered {rendered} previews; open {os.path.join(preview_dir, 'index.html')}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import cProfile
+import io
+import logging
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class ScrapeProfiler:
+    """
+    Profile a scrape across the main thread and all worker threads.
+
+    Two complementary profilers run at the same time:
+      - a deterministic cProfile per thread, timed with per-thread CPU time, merged into
+        one per-function report (`<prefix>.prof` for pstats/snakeviz, `<prefix>.txt`)
+      - a sampling profiler that snapshots every thread's stack and writes folded stacks
+        (`<prefix>.folded`) that flamegraph.pl / speedscope / inferno can read directly
+
+    Usage:
+        with ScrapeProfiler("scrape_profile"):
+            run_scrape()
+    """
+
+    def __init__(self, output_prefix: str, sample_interval: float = 0.005):
+        self.output_prefix = output_prefix
+        self.sample_interval = sample_interval
+        self._main_profile = cProfile.Profile(time.thread_time)
+        self._thread_profiles: list[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._sampler: threading.Thread = None
+
+    def __enter__(self) -> "ScrapeProfiler":
+        # start the sampler before installing the hook so it doesn't profile itself
+        self._sampler = threading.Thread(
+            target=self._sample_loop, name="scrape-profiler", daemon=True
+        )
+        self._sampler.start()
+        threading.setprofile(self._start_thread_profile)
+        self._main_profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._main_profile.disable()
+        threading.setprofile(None)
+        self._stop.set()
+        self._sampler.join()
+        self._write_outputs()
+
+    def _start_thread_profile(self, frame, event, arg) -> None:
+        """threading.setprofile hook: swap itself for a per-thread cProfile on first call."""
+        profile = cProfile.Profile(time.thread_time)
+        with self._lock:
+            self._thread_profiles.append(profile)
+        profile.enable()
+
+    def _sample_loop(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                # merge pool workers (ThreadPoolExecutor-0_3 -> ThreadPoolExecutor-0)
+                thread_name = re.sub(r"_\d+$", "", names.get(ident, str(ident)))
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(thread_name)
+                self._samples[";".join(reversed(stack))] += 1
+
+    def _write_outputs(self) -> None:
+        prefix = Path(self.output_prefix)
+        prefix.parent.mkdir(parents=True, exist_ok=True)
+
+        stats = pstats.Stats(self._main_profile)
+        for profile in self._thread_profiles:
+            stats.add(profile)
+        stats.dump_stats(f"{prefix}.prof")
+
+        report = io.StringIO()
+        stats.stream = report
+        report.write("Per-function CPU time (all threads), sorted by own time\n\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(50)
+        report.write("\nSorted by cumulative time\n\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(50)
+        with open(f"{prefix}.txt", "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+
+        with open(f"{prefix}.folded", "w", encoding="utf-8") as f:
+            for stack, count in self._samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        logger.info(
+            "profiled %d threads, %d stack samples",
+            len(self._thread_profiles) + 1,
+            sum(self._samples.values()),
+        )
+        print(
+            f"Profile written to {prefix}.txt, {prefix}.prof and {prefix}.folded "
+            "(flamegraph.pl / speedscope compatible)"
+        )
@@ -0,0 +1,153 @@
+"""
+Persistent cache of Graph API responses.
+
+Two namespaces are used by mapillary_api:
+  - FEATURE_IMAGES: feature id => `images.limit(...)` metadata response
+  - IMAGE_DETECTIONS: image id => detections response
+Entries expire after a TTL, or earlier at an explicit `expires_at` (feature responses
+carry signed CDN URLs that stop working at their own expiry). Each namespace is capped at
+`max_entries` (least recently used entries are evicted first), and hits/misses are counted
+per namespace. The cache is SQLite in WAL mode, so overlapping jobs and worker processes
+can share one file.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+FEATURE_IMAGES = "feature_images"
+IMAGE_DETECTIONS = "image_detections"
+
+# check namespace sizes every N writes rather than on each one
+_EVICT_EVERY = 500
+
+
+class ResponseCache:
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """)
+            columns = {
+                row[1] for row in self._conn.execute("PRAGMA table_info(responses)")
+            }
+            if "expires_at" not in columns:
+                # cache files created before entries could carry their own expiry
+                self._conn.execute("ALTER TABLE responses ADD COLUMN expires_at REAL")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_lru ON responses (namespace, accessed_at)"
+            )
+        self._hits: dict[str, int] = defaultdict(int)
+        self._misses: dict[str, int] = defaultdict(int)
+        self._writes: dict[str, int] = defaultdict(int)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def get(self, namespace: str, key) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at, expires_at FROM responses"
+                " WHERE namespace = ? AND key = ?",
+                (namespace, str(key)),
+            ).fetchone()
+            if (
+                row is None
+                or now - row[1] > self.ttl_seconds
+                or (row[2] is not None and now >= row[2])
+            ):
+                self._misses[namespace] += 1
+                return None
+            self._hits[namespace] += 1
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    (now, namespace, str(key)),
+                )
+        return json.loads(row[0])
+
+    def put(
+        self, namespace: str, key, value: Any, expires_at: Optional[float] = None
+    ) -> None:
+        """Store a response; `expires_at` (epoch seconds) can cut its TTL short."""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (namespace, str(key), json.dumps(value), now, now, expires_at),
+                )
+            # counted per namespace, so a low-traffic namespace still gets capped
+            self._writes[namespace] += 1
+            if self._writes[namespace] % _EVICT_EVERY == 0:
+                self._evict(namespace, now)
+
+    def _evict(self, namespace: str, now: float) -> None:
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM responses WHERE namespace = ?"
+                " AND (stored_at < ? OR expires_at <= ?)",
+                (namespace, now - self.ttl_seconds, now),
+            )
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM responses WHERE namespace = ?", (namespace,)
+            ).fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    """
+                    DELETE FROM responses WHERE rowid IN (
+                        SELECT rowid FROM responses WHERE namespace = ?
+                        ORDER BY accessed_at LIMIT ?
+                    )
+                    """,
+                    (namespace, excess),
+                )
+                logger.debug("evicted %d %s cache entries", excess, namespace)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        namespaces = set(self._hits) | set(self._misses)
+        return {
+            ns: {"hits": self._hits[ns], "misses": self._misses[ns]}
+            for ns in sorted(namespaces)
+        }
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def configure(
+    path: Optional[str],
+    ttl_seconds: float = 7 * 24 * 3600,
+    max_entries: int = 1_000_000,
+) -> Optional[ResponseCache]:
+    """Set (or with None, clear) the cache used by the Graph API call sites."""
+    global _cache
+    _cache = ResponseCache(path, ttl_seconds, max_entries) if path else None
+    return _cache
+
+
+def get_cache() -> Optional[ResponseCache]:
+    return _cache
@@ -1,23 +1,14 @@
 import argparse
 import ast
-from models import BBox, Tile
-from mapillary_api import (
-    get_valid_ids_in_tile,
-    save_images_with_detections_by_id,
-    get_valid_ids_in_bbox,
-)
 import logging
 import json
 import os
-from PIL import ImageDraw, Image
-import matplotlib.pyplot as plt
-import numpy as np
+from profiling import ScrapeProfiler
+
+# Heavy dependencies (pydantic models, requests, MVT decoding, PIL, matplotlib, numpy)
+# are imported inside the code paths that need them, so `--help` and short
+# sharded/cron invocations don't pay for them at startup.
 
-MONTREAL_BBOX = (-73.943481, 45.405380, -73.435364, 45.711154)
-# OTTAWA_BBOX = (-76.1, 45.2, -75.4, 45.5)
-# VANCOUVER_BBOX = (-123.284454, 49.009220, -122.498932, 49.373599)
-# subdivided into [(-123.284454, 49.00922, -122.891693, 49.1914095), (-122.891693, 49.00922, -122.498932, 49.1914095),
-# (-123.284454, 49.1914095, -122.891693, 49.373599), (-122.891693, 49.1914095, -122.498932, 49.373599)] for scraping
 
 LOG_LEVEL_MAP = {
     "DEBUG": logging.DEBUG,
@@ -44,93 +35,341 @@ def main():
         type=str,
         help="Tile coordinates to scrape (Z, X, Y). Example: (14, 4579, 5979)",
     )
+    mutex_group.add_argument(
+        "--replay-failures",
+        action="store_true",
+        help="Retry only the tiles, features and images recorded in the dead-letter store",
+    )
     parser.add_argument("--show-images", action="store_true", help="Show images")
+    parser.add_argument(
+        "--render-previews",
+        action="store_true",
+        help="Render annotated previews, contact sheets and an HTML index for the output directory",
+    )
+    parser.add_argument(
+        "--preview-dir",
+        type=str,
+        help="Preview output directory (default: <output-dir>_previews)",
+    )
+    parser.add_argument(
+        "--preview-workers",
+        type=int,
+        help="Worker processes for preview rendering (default: CPU count)",
+    )
     parser.add_argument(
         "--output-dir", "-o", type=str, help="Output directory", default="images"
     )
     parser.add_argument("--log-level", type=str, help="Log level", default="WARNING")
     parser.add_argument("--json-only", action="store_true", help="Only save JSON files")
+    parser.add_argument(
+        "--cpu-workers",
+        type=int,
+        help="Processes for MVT/image decoding (default: CPU count, or 0 = inline with --profile)",
+    )
+    parser.add_argument(
+        "--trust-tile-features",
+        action="store_true",
+        help="Build tile features without pydantic validation when they pass a shape check",
+    )
+    parser.add_argument(
+        "--max-in-flight-mb",
+        type=int,
+        help="Memory budget for downloaded images not yet saved (default: 512)",
+    )
+    parser.add_argument(
+        "--dedup",
+        choices=["skip", "flag"],
+        help="Perceptual-hash de-duplication: skip near-duplicate images or flag them in their JSON",
+    )
+    parser.add_argument(
+        "--dedup-distance",
+        type=int,
+        default=4,
+        help="Max Hamming distance (of 64 bits) for two images to count as near-duplicates",
+    )
+    parser.add_argument(
+        "--dead-letter-db",
+        type=str,
+        help="Where failed fetches are recorded (default: <output-dir>/.dead_letters.sqlite)",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="SQLite file for caching feature->images and image->detections API responses",
+    )
+    parser.add_argument(
+        "--cache-ttl-hours",
+        type=float,
+        default=24 * 7,
+        help="How long cached API responses stay valid",
+    )
+    parser.add_argument(
+        "--cache-max-entries",
+        type=int,
+        default=1_000_000,
+        help="Max cached responses per kind; least recently used are evicted",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only fetch images for features that are new or updated since the last scrape",
+    )
+    parser.add_argument(
+        "--min-tile-age-hours",
+        type=float,
+        default=0,
+        help="With --incremental, skip tiles scraped less than this many hours ago",
+    )
+    parser.add_argument(
+        "--state-db",
+        type=str,
+        help="Incremental scrape state (default: <output-dir>/.scrape_state.sqlite)",
+    )
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="Dry run: sample tiles, features and images and print the expected counts, bytes and ETA",
+    )
+    parser.add_argument(
+        "--estimate-sample-tiles",
+        type=int,
+        default=10,
+        help="Tiles to sample for --estimate",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the scrape (all threads) and write a CPU report and folded stacks",
+    )
+    parser.add_argument(
+        "--profile-output",
+        type=str,
+        help="Path prefix for the profiler outputs (.txt, .prof, .folded)",
+        default="scrape_profile",
+    )
     args = parser.parse_args()
+    if args.estimate and args.replay_failures:
+        parser.error("--estimate needs --bbox or --tile")
 
     logging.basicConfig(
         level=LOG_LEVEL_MAP[args.log_level],
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     )
-    logger = logging.getLogger(__name__)
 
-    if args.output_dir:
+    # an estimate writes nothing, not even the output directory
+    if args.output_dir and not args.estimate:
         os.makedirs(args.output_dir, exist_ok=True)
-    bbox = None
-    tile_coords = None
-    ids = None
 
+    if args.profile:
+        with ScrapeProfiler(args.profile_output):
+            scrape(args)
+    else:
+        scrape(args)
+    if args.estimate:
+        return
+
+    if args.render_previews:
+        from previews import render_previews
+
+        preview_dir = args.preview_dir or f"{args.output_dir.rstrip('/')}_previews"
+        rendered = render_previews(args.output_dir, preview_dir, args.preview_workers)
+        print(
+            f"Rendered {rendered} previews, see {os.path.join(preview_dir, 'index.html')}"
+        )
+
+    if args.show_images:
+        show_images(args.output_dir)
+
+
+def scrape(args: argparse.Namespace) -> None:
+    """Resolve features for the requested bbox/tile and save their images and detections."""
+    from config import MAP_CONFIG
+    import dead_letter
+    import response_cache
+
+    if args.cpu_workers is not None:
+        MAP_CONFIG.MAX_CPU_WORKERS = args.cpu_workers
+    elif args.profile:
+        # the profiler only sees this process, so keep decoding in it
+        MAP_CONFIG.MAX_CPU_WORKERS = 0
+    if args.max_in_flight_mb is not None:
+        MAP_CONFIG.MAX_IN_FLIGHT_BYTES = args.max_in_flight_mb * 1024 * 1024
+    MAP_CONFIG.TRUST_TILE_FEATURES = args.trust_tile_features
+    MAP_CONFIG.DEDUP_MODE = args.dedup
+    MAP_CONFIG.DEDUP_MAX_DISTANCE = args.dedup_distance
+
+    output_dir = args.output_dir
+    # failures sampled by --estimate are not recorded, so they can't be replayed later
+    store = dead_letter.configure(
+        None
+        if args.estimate
+        else args.dead_letter_db or os.path.join(output_dir, ".dead_letters.sqlite")
+    )
+    cache = response_cache.configure(
+        args.cache, args.cache_ttl_hours * 3600, args.cache_max_entries
+    )
+
+    try:
+        _run_scrape(args, store)
+    finally:
+        if cache:
+            for kind, counts in cache.stats().items():
+                print(
+                    f"API cache {kind}: {counts['hits']} hits, {counts['misses']} misses"
+                )
+
+
+def _run_scrape(args: argparse.Namespace, store) -> None:
+    """Resolve features for the requested bbox/tile (or replay failures) and save images."""
+    import time
+
+    import dead_letter
+    from map_utils import get_tiles_in_bbox
+    from models import BBox, Tile
+    from mapillary_api import (
+        save_images_with_detections_by_id,
+        get_valid_ids_in_tiles,
+        replay_failures,
+    )
+    from scrape_state import ScrapeState
+
+    output_dir = args.output_dir
+
+    if args.replay_failures:
+        saved = replay_failures(store, output_dir, json_only=args.json_only)
+        print(f"Saved {saved} images with detections from replayed failures")
+        _report_failures(store)
+        return
+
+    state = None
+    if args.incremental:
+        state_path = args.state_db or os.path.join(output_dir, ".scrape_state.sqlite")
+        # an estimate only reads the state, so it doesn't create one
+        if not args.estimate or os.path.exists(state_path):
+            state = ScrapeState(state_path)
+    run_started = time.time()
+
+    tiles = []
     if args.bbox:
         bbox = ast.literal_eval(args.bbox)
         bbox = BBox(west=bbox[0], south=bbox[1], east=bbox[2], north=bbox[3])
-        ids = get_valid_ids_in_bbox(bbox, strict=True)
+        tiles = get_tiles_in_bbox(bbox, strict=True)
     elif args.tile:
         tile_coords = ast.literal_eval(args.tile)
-        tile_coords = Tile(z=tile_coords[0], x=tile_coords[1], y=tile_coords[2])
-        ids = get_valid_ids_in_tile(tile_coords)
+        tiles = [Tile(z=tile_coords[0], x=tile_coords[1], y=tile_coords[2])]
 
-    output_dir = args.output_dir
+    if state is not None and args.min_tile_age_hours:
+        total = len(tiles)
+        tiles = state.filter_stale_tiles(
+            tiles, int(args.min_tile_age_hours * 3_600_000)
+        )
+        print(
+            f"{total - len(tiles)} of {total} tiles were scraped recently, skipping them"
+        )
+
+    if args.estimate:
+        from estimate import estimate_scrape, format_estimate
 
+        est = estimate_scrape(
+            tiles, sample_tiles=args.estimate_sample_tiles, json_only=args.json_only
+        )
+        print(format_estimate(est))
+        return
+
+    ids = get_valid_ids_in_tiles(tiles)
     print(f"found {len(ids)} detection ids")
+
+    failed_ids = None
+    if state is not None:
+        total = len(ids)
+        ids = state.filter_new_or_updated(ids)
+        print(
+            f"{len(ids)} of {total} detection ids are new or updated since the last scrape"
+        )
+        failed_ids = set()
+
     images_with_detections = save_images_with_detections_by_id(
-        ids, output_dir, json_only=args.json_only
+        ids, output_dir, json_only=args.json_only, failed_feature_ids=failed_ids
     )
     print(f"Saved {images_with_detections} images with detections")
 
-    # iterate through images with detections, in the images directory
-    if args.show_images:
+    if state is not None:
+        # anything that failed this run stays unrecorded, so the next run retries it
+        failed_tiles = {
+            entry.key
+            for entry in store.pending(dead_letter.TILE)
+            if entry.last_failed_at >= run_started
+        }
+        with state:
+            state.record_features([f for f in ids if f.id not in failed_ids])
+            state.record_tiles([t for t in tiles if str(t) not in failed_tiles])
+
+    _report_failures(store)
+
+
+def _report_failures(store) -> None:
+    counts = store.counts()
+    if counts:
+        summary = ", ".join(f"{n} {kind}s" for kind, n in sorted(counts.items()))
+        print(
+            f"Failed fetches pending in {store.path}: {summary}. "
+            "Retry them with --replay-failures."
+        )
+
+
+def show_images(output_dir: str) -> None:
+    """Iterate through images with detections in the output directory and display them."""
+    from PIL import ImageDraw, Image
+    import matplotlib.pyplot as plt
+    import numpy as np
 
-        for entry in os.listdir(output_dir):
-            entry_path = os.path.join(output_dir, entry)
-            if not os.path.isdir(entry_path):
-                continue
+    for entry in os.listdir(output_dir):
+        entry_path = os.path.join(output_dir, entry)
+        if not os.path.isdir(entry_path):
+            continue
 
-            image_id = entry
-            jpg_path = os.path.join(entry_path, f"{image_id}.jpg")
-            json_path = os.path.join(entry_path, f"{image_id}.json")
+        image_id = entry
+        jpg_path = os.path.join(entry_path, f"{image_id}.jpg")
+        json_path = os.path.join(entry_path, f"{image_id}.json")
 
-            if not (os.path.isfile(jpg_path) and os.path.isfile(json_path)):
-                continue
+        if not (os.path.isfile(jpg_path) and os.path.isfile(json_path)):
+            continue
 
-            # Load image
+        # Load image
 
-            with Image.open(jpg_path) as im:
-                im = im.convert("RGB")  # Ensure RGB for drawing
+        with Image.open(jpg_path) as im:
+            im = im.convert("RGB")  # Ensure RGB for drawing
 
-                # Load detections
-                with open(json_path, "r", encoding="utf-8") as f:
-                    img_data = json.load(f)
-                draw = ImageDraw.Draw(im)
-                creator_username = img_data.get("creator", {}).get("username")
-                creator_id = img_data.get("creator", {}).get("id")
-                lat = img_data.get("lat")
-                lon = img_data.get("lon")
-                sequence = img_data.get("sequence")
+            # Load detections
+            with open(json_path, "r", encoding="utf-8") as f:
+                img_data = json.load(f)
+            draw = ImageDraw.Draw(im)
+            creator_username = img_data.get("creator", {}).get("username")
+            creator_id = img_data.get("creator", {}).get("id")
+            lat = img_data.get("lat")
+            lon = img_data.get("lon")
+            sequence = img_data.get("sequence")
 
-                # Try to get extra info from the first detection if available
-                detections = img_data.get("detections", [])
-                det_class = None
+            # Try to get extra info from the first detection if available
+            detections = img_data.get("detections", [])
+            det_class = None
 
-                for det in detections:
-                    det_class = det.get("value")
-                    bbox = det.get("bbox")
+            for det in detections:
+                det_class = det.get("value")
+                bbox = det.get("bbox")
 
-                    if not bbox:
-                        continue
+                if not bbox:
+                    continue
 
-                    draw.rectangle(bbox, outline="magenta", width=3)
+                draw.rectangle(bbox, outline="magenta", width=3)
 
-                title = f"{det_class} | {sequence} {creator_username} ({creator_id}) | ({lat}, {lon})"
+            title = f"{det_class} | {sequence} {creator_username} ({creator_id}) | ({lat}, {lon})"
 
-                plt.imshow(np.array(im))
-                plt.title(title)
-                plt.axis("off")
-                plt.show()
-                plt.close()
+            plt.imshow(np.array(im))
+            plt.title(title)
+            plt.axis("off")
+            plt.show()
+            plt.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+import logging
+import sqlite3
+import time
+from typing import Iterable
+
+from models import Tile, TrafficSignFeature
+
+logger = logging.getLogger(__name__)
+
+# sqlite's default limit on host parameters is 999
+_QUERY_CHUNK = 900
+
+
+class ScrapeState:
+    """
+    Persistent record of what has already been scraped, for incremental re-scrapes.
+
+    Stores, per feature, the `last_seen_at` it had when its images were fetched, and per
+    tile, when it was last scraped. A feature only needs to be re-resolved when it is new
+    or Mapillary reports a newer `last_seen_at` (i.e. it was seen in new imagery).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS features (
+                id INTEGER PRIMARY KEY,
+                last_seen_at INTEGER NOT NULL,
+                scraped_at INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tiles (
+                z INTEGER NOT NULL,
+                x INTEGER NOT NULL,
+                y INTEGER NOT NULL,
+                scraped_at INTEGER NOT NULL,
+                PRIMARY KEY (z, x, y)
+            );
+            """)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> "ScrapeState":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def filter_new_or_updated(
+        self, features: list[TrafficSignFeature]
+    ) -> list[TrafficSignFeature]:
+        """Keep features never scraped before, or seen in newer imagery since the last scrape."""
+        stored: dict[int, int] = {}
+        ids = [f.id for f in features]
+        for i in range(0, len(ids), _QUERY_CHUNK):
+            chunk = ids[i : i + _QUERY_CHUNK]
+            rows = self._conn.execute(
+                f"SELECT id, last_seen_at FROM features WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            stored.update(rows)
+
+        out = [
+            f
+            for f in features
+            if f.id not in stored or f.properties.last_seen_at > stored[f.id]
+        ]
+        logger.info(
+            "%d of %d features are new or updated since the last scrape",
+            len(out),
+            len(features),
+        )
+        return out
+
+    def record_features(
+        self, features: Iterable[TrafficSignFeature], scraped_at: int = None
+    ) -> None:
+        scraped_at = scraped_at or int(time.time() * 1000)
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO features (id, last_seen_at, scraped_at) VALUES (?, ?, ?)",
+                ((f.id, f.properties.last_seen_at, scraped_at) for f in features),
+            )
+
+    def record_tiles(self, tiles: Iterable[Tile], scraped_at: int = None) -> None:
+        scraped_at = scraped_at or int(time.time() * 1000)
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tiles (z, x, y, scraped_at) VALUES (?, ?, ?, ?)",
+                ((t.z, t.x, t.y, scraped_at) for t in tiles),
+            )
+
+    def filter_stale_tiles(self, tiles: list[Tile], min_age_ms: int) -> list[Tile]:
+        """Keep tiles never scraped, or last scraped at least `min_age_ms` ago."""
+        cutoff = int(time.time() * 1000) - min_age_ms
+        out = []
+        for tile in tiles:
+            row = self._conn.execute(
+                "SELECT scraped_at FROM tiles WHERE z = ? AND x = ? AND y = ?",
+                (tile.z, tile.x, tile.y),
+            ).fetchone()
+            if row is None or row[0] <= cutoff:
+                out.append(tile)
+        logger.info(
+            "%d of %d tiles were not scraped in the last %.1f hours",
+            len(out),
+            len(tiles),
+            min_age_ms / 3_600_000,
+        )
+        return out
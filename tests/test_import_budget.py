@@ -0,0 +1,54 @@
+"""
+Startup budget: importing the entry-point scripts (what `--help` pays for) must not
+load the heavy dependencies, which are only imported on the code paths that use them.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = [
+    "PIL",
+    "matplotlib",
+    "numpy",
+    "requests",
+    "mapbox_vector_tile",
+    "pydantic",
+    "psycopg2",
+    "label_studio_sdk",
+]
+
+
+def _loaded_heavy_modules(directory: str, module: str) -> list[str]:
+    code = (
+        f"import json, sys; import {module}; "
+        f"print(json.dumps(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.join(REPO_ROOT, directory),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize(
+    "directory, module",
+    [
+        ("scrape", "scrape_bounding_box"),
+        ("scrape", "job_runner"),
+        ("labelling_pipeline", "label_studio_job"),
+        ("labelling_pipeline", "db_job"),
+        ("labelling_pipeline", "migrate"),
+        ("labelling_pipeline", "delete_all_tasks"),
+    ],
+)
+def test_entry_point_import_skips_heavy_dependencies(directory, module):
+    assert _loaded_heavy_modules(directory, module) == []